@@ -0,0 +1,179 @@
+"""Benchmark de extremo a extremo de agentDATALAKE, agent y chain sin servicios externos.
+
+Usa el modelo de chat falso con guion de herramientas y el servidor de datalake local de
+benchmarks/fakes.py. Reporta latencia p50/p95, throughput, tiempo por fase (LLM, E/S de
+herramientas, parseo y serialización) y memoria máxima, barriendo el tamaño de la historia
+y el número de sesiones concurrentes.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_agentes.py --agente datalake --fechas 30,365 --sesiones 1,8 --preguntas 5
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(".")
+from benchmarks.fakes import ENTORNO_FALSO, ModeloFalso, ServidorDatalakeFalso, generar_datos, medidor
+
+PREGUNTA = "¿Cómo fue el cierre de ayer y cuáles fueron las tareas más largas?"
+
+
+def percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def crear_base_sqlite(detalle, ruta: str):
+    """Carga el detalle sintético en una tabla Cierre con el esquema de data/sqlite/cierre.db."""
+    tabla = detalle.drop(columns=["DURACION"]).rename(columns={"DURACION_SEGUNDOS": "DURACION"})
+    tabla["FECHA_CIERRE"] = tabla.FECHA_CIERRE.astype(str)
+    conn = sqlite3.connect(ruta)
+    tabla.to_sql("Cierre", conn, index=False, if_exists="replace")
+    conn.close()
+
+
+def preparar_datalake(modelo: ModeloFalso):
+    from src.QACierreCaliMemV2 import agentDATALAKE
+    from src.QACierreCaliMemV2.cache_respuestas import CacheRespuestas
+    from src.QACierreCaliMemV2.enrutador import EnrutadorPreguntas
+    from src.QACierreCaliMemV2.espejo_columnar import espejo
+
+    agentDATALAKE.cache.invalidar()
+    espejo.reiniciar()
+    # Sin enrutador ni cache de respuestas para medir el ciclo completo del agente
+    agentDATALAKE.enrutador = EnrutadorPreguntas(activo=False)
+    agentDATALAKE.cache_respuestas = CacheRespuestas(max_entradas=0)
+    for herramienta in agentDATALAKE.obtener_herramientas():
+        herramienta.callbacks = [medidor]
+    agentDATALAKE.configurar_llm(modelo)
+    return agentDATALAKE.get_response, agentDATALAKE.aget_response
+
+
+def apuntar_repositorio(url: str):
+    """Dirige el repositorio compartido a la base SQLite sintética del escenario."""
+    from src.QACierreCaliMemV2 import repositorio_cierre
+
+    repositorio_cierre._repositorio = repositorio_cierre.RepositorioCierre(repositorio_cierre.crear_engine(url))
+
+
+def preparar_sqlite(modelo: ModeloFalso, url: str):
+    from langchain_core.tools import StructuredTool
+    from src.QACierreCaliMemV2 import agent
+
+    apuntar_repositorio(url)
+    herramientas = [StructuredTool.from_function(f, callbacks=[medidor])
+                    for f in (agent.obtener_datos_por_proceso_de_cierre, agent.obtener_datos_tareas_mayor_duracion_por_fecha)]
+    agent.configurar_llm(modelo, herramientas)
+    return (lambda pregunta, thread_id: agent.get_response(pregunta)), None
+
+
+def preparar_chain(modelo: ModeloFalso, url: str):
+    from src.QACierreCaliMemV2 import chain
+
+    apuntar_repositorio(url)
+    chain.configurar_llm(modelo)
+    return chain.get_response, None
+
+
+def correr(nombre: str, get_response, aget_response, sesiones: int, preguntas: int, usar_async: bool) -> dict:
+    from src.QACierreCaliMemV2.cliente_datalake import cliente
+
+    medidor.reiniciar()
+    io_inicial = cliente.resumen_metricas()
+    latencias = []
+
+    def sesion(i: int):
+        for _ in range(preguntas):
+            inicio = time.perf_counter()
+            get_response(PREGUNTA, f"bench-{nombre}-{i}")
+            latencias.append(time.perf_counter() - inicio)
+
+    async def asesion(i: int):
+        for _ in range(preguntas):
+            inicio = time.perf_counter()
+            await aget_response(PREGUNTA, f"bench-{nombre}-{i}")
+            latencias.append(time.perf_counter() - inicio)
+
+    async def acorrer():
+        await asyncio.gather(*(asesion(i) for i in range(sesiones)))
+
+    inicio = time.perf_counter()
+    if usar_async and aget_response is not None:
+        asyncio.run(acorrer())
+    else:
+        with ThreadPoolExecutor(sesiones) as executor:
+            list(executor.map(sesion, range(sesiones)))
+    total = time.perf_counter() - inicio
+
+    io_final = cliente.resumen_metricas()
+    io = io_final["segundos"] - io_inicial["segundos"]
+    return {
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p95_ms": percentil(latencias, 0.95) * 1000,
+        "turnos_s": len(latencias) / total,
+        "llm_s": medidor.fases["llm"],
+        "io_s": io,
+        "parseo_s": max(0.0, medidor.fases["herramientas"] - io),
+        "bytes": io_final["bytes"] - io_inicial["bytes"],
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agente", choices=["datalake", "sqlite", "chain", "todos"], default="todos")
+    parser.add_argument("--fechas", default="30,365", help="tamaños de historia separados por coma")
+    parser.add_argument("--tareas", type=int, default=200, help="tareas por cierre")
+    parser.add_argument("--sesiones", default="1,8", help="sesiones concurrentes separadas por coma")
+    parser.add_argument("--preguntas", type=int, default=5, help="preguntas por sesión")
+    parser.add_argument("--latencia-llm", type=float, default=0.0)
+    parser.add_argument("--latencia-datalake", type=float, default=0.0)
+    parser.add_argument("--ttl", type=float, default=None, help="TTL de la cache del datalake; 0 revalida siempre")
+    parser.add_argument("--async", dest="usar_async", action="store_true", help="usa aget_response cuando exista")
+    args = parser.parse_args()
+
+    os.environ.update(ENTORNO_FALSO)
+    directorio = tempfile.mkdtemp()
+    os.environ["CHECKPOINTER_DIR"] = directorio
+    agentes = ["datalake", "sqlite", "chain"] if args.agente == "todos" else [args.agente]
+
+    print(f"{'agente':<9}{'fechas':>7}{'sesiones':>9}{'p50 ms':>10}{'p95 ms':>10}{'turnos/s':>10}"
+          f"{'llm s':>8}{'io s':>8}{'parseo s':>9}{'MB red':>8}{'RSS MB':>8}")
+    for fechas in [int(f) for f in args.fechas.split(",")]:
+        datos = generar_datos(fechas, args.tareas)
+        ruta_db = os.path.join(directorio, f"cierre_{fechas}.db")
+        crear_base_sqlite(datos["detalle"], ruta_db)
+        guion = {
+            "datalake": [[("obtener_datos_cierre_comercial", {"ultimos": 1}), ("obtener_datos_cierre_normativo", {"ultimos": 1})],
+                         [("obtener_datos_tareas_mayor_duracion_por_fecha", {"fecha_cierre": datos["ultima_fecha"].isoformat()})]],
+            "sqlite": [[("obtener_datos_por_proceso_de_cierre", {"ultimos": 1})],
+                       [("obtener_datos_tareas_mayor_duracion_por_fecha", {"fecha_cierre": datos["ultima_fecha"].isoformat()})]],
+            "chain": [],
+        }
+        with ServidorDatalakeFalso(datos, args.latencia_datalake) as servidor:
+            os.environ.update(servidor.variables_entorno())
+            for nombre in agentes:
+                modelo = ModeloFalso(guion=guion[nombre], latencia=args.latencia_llm)
+                if nombre == "datalake":
+                    get_response, aget_response = preparar_datalake(modelo)
+                    if args.ttl is not None:
+                        from src.QACierreCaliMemV2.cache_datalake import cache
+                        cache.ttl = args.ttl
+                elif nombre == "sqlite":
+                    get_response, aget_response = preparar_sqlite(modelo, f"sqlite:///{ruta_db}")
+                else:
+                    get_response, aget_response = preparar_chain(modelo, f"sqlite:///{ruta_db}")
+                for sesiones in [int(s) for s in args.sesiones.split(",")]:
+                    r = correr(nombre, get_response, aget_response, sesiones, args.preguntas, args.usar_async)
+                    print(f"{nombre:<9}{fechas:>7}{sesiones:>9}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['turnos_s']:>10.1f}"
+                          f"{r['llm_s']:>8.2f}{r['io_s']:>8.2f}{r['parseo_s']:>9.2f}{r['bytes'] / 1e6:>8.2f}{r['rss_mb']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
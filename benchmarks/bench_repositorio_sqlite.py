@@ -0,0 +1,96 @@
+"""Micro-benchmark del acceso SQLite de agent.py: consulta concatenada + JSON con f-strings
+contra el repositorio con parámetros enlazados, pool con PRAGMAS y orjson.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_repositorio_sqlite.py --fechas 365 --tareas 400 --repeticiones 200
+"""
+import argparse
+from datetime import date, datetime, timedelta
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(".")
+
+
+def crear_base(ruta: str, fechas: int, tareas: int):
+    conn = sqlite3.connect(ruta)
+    conn.execute("""create table Cierre (FECHA_CIERRE TEXT, DURACION INTEGER, CODIGO_TAREA TEXT,
+                    DESCRIPCION_TAREA TEXT, INICIO TEXT, FIN TEXT)""")
+    inicio = date(2024, 1, 1)
+    filas = []
+    for d in range(fechas):
+        fecha = inicio + timedelta(days=d)
+        hora = datetime(fecha.year, fecha.month, fecha.day, 20)
+        for t in range(tareas):
+            duracion = random.randint(1, 1800)
+            fin = hora + timedelta(seconds=duracion)
+            filas.append((fecha.isoformat(), duracion, f"T{t:04d}", f"Tarea {t}", hora.isoformat(" "), fin.isoformat(" ")))
+            hora = fin
+    conn.executemany("insert into Cierre values (?,?,?,?,?,?)", filas)
+    conn.commit()
+    conn.close()
+    return [inicio + timedelta(days=d) for d in range(fechas)]
+
+
+def ruta_actual(engine, fecha_cierre: date) -> str:
+    """Implementación original de obtener_datos_tareas_mayor_duracion_por_fecha."""
+    from sqlalchemy import text
+    query= """select FECHA_CIERRE, TIME( DURACION, 'unixepoch') as DURACION, CODIGO_TAREA, DESCRIPCION_TAREA,
+                DATETIME(INICIO) as INICIO, DATETIME( FIN) as FIN
+                from Cierre
+                WHERE FECHA_CIERRE = """
+    query += "'" + fecha_cierre.strftime("%Y-%m-%d") + "'"
+    query += " order by DURACION desc LIMIT 10"
+    context= "["
+    with engine.connect() as connection:
+        result = connection.execute(text(query))
+        for row in result:
+            context += f'{{"FECHA_CIERRE":"{row[0]},"DURACION":"{row[1]}", "CODIGO_TAREA":"{row[2]}", "DESCRIPCION_TAREA":"{row[3]}", "INICIO":"{row[4]}", "FIN":"{row[5]}"}}, '
+    context += "]"
+    return context
+
+
+def medir(nombre: str, funcion, fechas: list, repeticiones: int):
+    tiempos = []
+    for i in range(repeticiones):
+        fecha = fechas[i % len(fechas)]
+        inicio = time.perf_counter()
+        funcion(fecha)
+        tiempos.append(time.perf_counter() - inicio)
+    tiempos.sort()
+    p50 = tiempos[len(tiempos) // 2] * 1000
+    p95 = tiempos[int(len(tiempos) * 0.95) - 1] * 1000
+    print(f"{nombre:<12} p50={p50:8.3f} ms  p95={p95:8.3f} ms  total={sum(tiempos):7.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fechas", type=int, default=365)
+    parser.add_argument("--tareas", type=int, default=400)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp()
+    ruta = os.path.join(directorio, "cierre.db")
+    fechas = crear_base(ruta, args.fechas, args.tareas)
+    url = f"sqlite:///{ruta}"
+
+    from sqlalchemy import create_engine
+    from src.QACierreCaliMemV2.repositorio_cierre import RepositorioCierre, crear_engine, a_json
+
+    print(f"{args.fechas} fechas x {args.tareas} tareas, {args.repeticiones} consultas")
+    # La ruta actual se mide antes de que el repositorio cree el índice, como en producción
+    engine_actual = create_engine(url)
+    medir("actual", lambda f: ruta_actual(engine_actual, f), fechas, args.repeticiones)
+
+    repositorio = RepositorioCierre(crear_engine(url))
+    repositorio.resumen()
+    medir("repositorio", lambda f: a_json(repositorio.tareas_mayor_duracion(f, 10)), fechas, args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
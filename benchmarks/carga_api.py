@@ -0,0 +1,97 @@
+"""Prueba de carga del modo multi-worker (servidor_api) con el modelo y el datalake falsos.
+
+Para cada número de workers levanta uvicorn con benchmarks.servidor_falso:app, con el
+estado de los hilos en un SQLite compartido. Luego lanza `--clientes` clientes concurrentes
+y reporta throughput y latencia, para ver cómo escala con los workers.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/carga_api.py --workers 1,2,4 --clientes 16 --peticiones 200
+
+Resultados con los valores por defecto (365 fechas, --latencia-llm 0.05, --trabajo-cpu 0.02,
+que retiene el GIL) en una máquina de 1 CPU:
+
+    workers  peticiones/s   p50 ms   p95 ms
+          1           9.7   1613.5   1761.6
+          2          13.8   1133.2   1460.4
+          4          14.0   1102.1   1721.3
+
+De 1 a 2 workers la espera del modelo de uno se solapa con el trabajo de CPU de otro; desde ahí
+el único núcleo limita el throughput y el p95 vuelve a subir. Con varios núcleos 4 workers
+deberían rendir más.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.append(".")
+from benchmarks.fakes import ENTORNO_FALSO, ServidorDatalakeFalso, generar_datos
+
+
+def esperar_servidor(url: str, limite: float = 60.0):
+    fin = time.time() + limite
+    while time.time() < fin:
+        try:
+            with urllib.request.urlopen(f"{url}/salud", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"El servidor {url} no respondió")
+
+
+def preguntar(url: str, i: int) -> float:
+    cuerpo = json.dumps({"pregunta": "¿Cómo fue el cierre de ayer?", "thread_id": f"carga-{i}"}).encode("utf-8")
+    peticion = urllib.request.Request(f"{url}/respuesta", data=cuerpo, headers={"Content-Type": "application/json"})
+    inicio = time.perf_counter()
+    with urllib.request.urlopen(peticion, timeout=120) as respuesta:
+        respuesta.read()
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--clientes", type=int, default=16)
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--fechas", type=int, default=365)
+    parser.add_argument("--puerto", type=int, default=8011)
+    parser.add_argument("--latencia-llm", default="0.05")
+    parser.add_argument("--trabajo-cpu", default="0.02")
+    args = parser.parse_args()
+
+    datos = generar_datos(args.fechas, 200)
+    with ServidorDatalakeFalso(datos) as datalake:
+        print(f"{'workers':>8}{'peticiones/s':>14}{'p50 ms':>10}{'p95 ms':>10}")
+        for workers in [int(w) for w in args.workers.split(",")]:
+            entorno = dict(os.environ, **ENTORNO_FALSO, **datalake.variables_entorno())
+            entorno.update({"CHECKPOINTER": "sqlite", "CHECKPOINTER_DIR": tempfile.mkdtemp(),
+                            "BENCH_ULTIMA_FECHA": datos["ultima_fecha"].isoformat(),
+                            "BENCH_LATENCIA_LLM": args.latencia_llm, "BENCH_TRABAJO_CPU": args.trabajo_cpu,
+                            "LOG_LEVEL": "WARNING"})
+            servidor = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "benchmarks.servidor_falso:app", "--port", str(args.puerto),
+                 "--workers", str(workers), "--log-level", "warning"], env=entorno)
+            url = f"http://127.0.0.1:{args.puerto}"
+            try:
+                esperar_servidor(url)
+                # Calentamiento: cada worker crea su agente y carga los datos
+                with ThreadPoolExecutor(workers * 2) as executor:
+                    list(executor.map(lambda i: preguntar(url, i), range(workers * 4)))
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(args.clientes) as executor:
+                    latencias = sorted(executor.map(lambda i: preguntar(url, i), range(args.peticiones)))
+                total = time.perf_counter() - inicio
+                print(f"{workers:>8}{args.peticiones / total:>14.1f}{latencias[len(latencias) // 2] * 1000:>10.1f}"
+                      f"{latencias[int(len(latencias) * 0.95) - 1] * 1000:>10.1f}")
+            finally:
+                servidor.terminate()
+                servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Dobles locales para medir los agentes sin Azure OpenAI, Groq ni el datalake:
+un modelo de chat determinista que emite llamadas a herramientas según un guion,
+un servidor HTTP que sirve el resumen y el detalle de tareas sintéticos, y un
+medidor de tiempos por fase.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+from io import BytesIO
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Any
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+import orjson
+import pandas as pd
+
+
+class Medidor(BaseCallbackHandler):
+    """Acumula segundos por fase; también registra la duración de las herramientas como callback."""
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._inicio_herramientas = {}
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._candado:
+            self.fases = {"llm": 0.0, "herramientas": 0.0}
+
+    def sumar(self, fase: str, segundos: float):
+        with self._candado:
+            self.fases[fase] = self.fases.get(fase, 0.0) + segundos
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._inicio_herramientas[run_id] = time.perf_counter()
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        inicio = self._inicio_herramientas.pop(run_id, None)
+        if inicio is not None:
+            self.sumar("herramientas", time.perf_counter() - inicio)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.on_tool_end(None, run_id=run_id)
+
+
+medidor = Medidor()
+
+
+class ModeloFalso(BaseChatModel):
+    """Modelo de chat determinista. `guion` es una lista de pasos; cada paso es una lista de
+    (nombre_herramienta, argumentos) que se emiten como tool_calls en paralelo. Cuando se agotan
+    los pasos de la pregunta actual responde `respuesta`."""
+
+    guion: list = []
+    respuesta: str = "El cierre comercial finalizó a tiempo."
+    latencia: float = 0.0
+    #segundos de CPU ocupada por llamada, para simular trabajo que no libera el GIL
+    trabajo_cpu: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "falso"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self
+
+    def _ocupar_cpu(self):
+        fin = time.perf_counter() + self.trabajo_cpu
+        while time.perf_counter() < fin:
+            pass
+
+    def _mensaje(self, messages: list) -> AIMessage:
+        self._ocupar_cpu()
+        paso = 0
+        for m in reversed(messages):
+            if isinstance(m, HumanMessage):
+                break
+            if isinstance(m, AIMessage):
+                paso += 1
+        if paso < len(self.guion):
+            llamadas = [{"name": nombre, "args": args, "id": f"call_{paso}_{i}"}
+                        for i, (nombre, args) in enumerate(self.guion[paso])]
+            return AIMessage(content="", tool_calls=llamadas)
+        return AIMessage(content=self.respuesta)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        inicio = time.perf_counter()
+        time.sleep(self.latencia)
+        mensaje = self._mensaje(messages)
+        medidor.sumar("llm", time.perf_counter() - inicio)
+        return ChatResult(generations=[ChatGeneration(message=mensaje)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        inicio = time.perf_counter()
+        await asyncio.sleep(self.latencia)
+        mensaje = self._mensaje(messages)
+        medidor.sumar("llm", time.perf_counter() - inicio)
+        return ChatResult(generations=[ChatGeneration(message=mensaje)])
+
+
+def _hhmmss(segundos: int) -> str:
+    return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+def generar_datos(fechas: int, tareas: int, semilla: int = 7) -> dict:
+    """Genera el resumen comercial, el normativo (JSON) y el detalle de tareas (parquet y
+    DataFrame) para `fechas` cierres consecutivos hasta ayer, con `tareas` tareas por cierre."""
+    aleatorio = random.Random(semilla)
+    ultima = date.today() - timedelta(days=1)
+    resumen, normativo, detalle = [], [], []
+    for d in range(fechas - 1, -1, -1):
+        fecha = ultima - timedelta(days=d)
+        hora = datetime(fecha.year, fecha.month, fecha.day, 20)
+        inicio_cierre = hora
+        pausas = 0
+        menu = None
+        for t in range(tareas):
+            duracion = aleatorio.randint(10, 900)
+            codigo = "PAUSA" if t % 25 == 24 else f"T{t:04d}"
+            descripcion = "Habilita accesos al menu" if t == int(tareas * 0.8) else f"Tarea {t}"
+            fin = hora + timedelta(seconds=duracion)
+            if codigo == "PAUSA":
+                pausas += duracion
+            if descripcion == "Habilita accesos al menu":
+                menu = fin
+            detalle.append({"FECHA_CIERRE": fecha, "DURACION_SEGUNDOS": duracion, "DURACION": _hhmmss(duracion),
+                            "CODIGO_TAREA": codigo, "DESCRIPCION_TAREA": descripcion,
+                            "INICIO": hora.isoformat(" "), "FIN": fin.isoformat(" ")})
+            hora = fin
+        total = int((hora - inicio_cierre).total_seconds())
+        resumen.append({"FECHA_CIERRE": f"{fecha.isoformat()}T00:00:00",
+                        "DURACION_TOTAL_CIERRE_SEGUNDOS": total, "DURACION_SIN_PAUSAS_SEGUNDOS": total - pausas,
+                        "DURACION_TOTAL": _hhmmss(total), "DURACION_SIN_PAUSAS": _hhmmss(total - pausas),
+                        "INICIO_CIERRE": inicio_cierre.isoformat(" "), "FIN_CIERRE": hora.isoformat(" "),
+                        "HORA_HABILITAR_MENU": (menu or hora).isoformat(" ")})
+        normativo.append({"FECHA_CIERRE": f"{fecha.isoformat()}T00:00:00",
+                          "FIN_BANDEJA4": (hora + timedelta(hours=1)).isoformat(" "),
+                          "FIN_BANDEJA8": (hora + timedelta(hours=2)).isoformat(" ")})
+    df_detalle = pd.DataFrame(detalle)
+    parquet = BytesIO()
+    df_detalle.to_parquet(parquet, index=False)
+    return {
+        "detalle": df_detalle,
+        "/resumen.json": orjson.dumps(resumen),
+        "/normativo.json": orjson.dumps(normativo),
+        "/tareas.parquet": parquet.getvalue(),
+        "ultima_fecha": ultima,
+    }
+
+
+class ServidorDatalakeFalso:
+    """Servidor HTTP local que sirve los archivos sintéticos con ETag y respuestas 304."""
+
+    def __init__(self, datos: dict, latencia: float = 0.0):
+        self.datos = datos
+        self.latencia = latencia
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(servidor.latencia)
+                ruta = self.path.split("?", 1)[0]
+                contenido = servidor.datos.get(ruta)
+                if not isinstance(contenido, bytes):
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = '"' + hashlib.md5(contenido).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(contenido)))
+                self.end_headers()
+                self.wfile.write(contenido)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._hilo = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def variables_entorno(self) -> dict:
+        return {
+            "RESUMEN_CIERRE_URL": self.url + "/resumen.json",
+            "RESUMEN_CIERE_NORMATIVO_URL": self.url + "/normativo.json",
+            "DETALLE_TAREAS_URL": self.url + "/tareas.parquet",
+            "AZURE_DATALAKE_GENAI_TOKEN": "sv=falso",
+        }
+
+
+#Credenciales ficticias para que los módulos construyan sus clientes sin conectarse, y
+#directorios temporales para las copias persistidas y el espejo columnar
+DIRECTORIO_TEMPORAL = tempfile.mkdtemp(prefix="bench_cierre_")
+ENTORNO_FALSO = {
+    "AZURE_OPENAI_ENDPOINT": "http://127.0.0.1:9",
+    "AZURE_OPENAI_DEPLOYMENT": "falso",
+    "AZURE_OPENAI_API_KEY": "falso",
+    "OPENAI_API_VERSION": "2024-06-01",
+    "GROQ_API_KEY": "falso",
+    "CHECKPOINTER": "memoria",
+    "DATALAKE_CACHE_DIR": os.path.join(DIRECTORIO_TEMPORAL, "blobs"),
+    "ESPEJO_DIR": DIRECTORIO_TEMPORAL,
+    "TRAZAS_ARCHIVO": os.path.join(DIRECTORIO_TEMPORAL, "trazas.jsonl"),
+}
@@ -0,0 +1,65 @@
+"""Perfil de tiempo de importación y arranque en frío de los módulos de la aplicación.
+
+Ejecuta `python -X importtime -c "import <modulo>"` en un proceso nuevo, lista los paquetes
+con mayor tiempo acumulado y mide el arranque en frío (mediana de varios procesos nuevos).
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/importtime.py --modulo src.QACierreCaliMemV2.agentDATALAKE --top 20
+
+Para comparar contra otra versión se ejecuta este archivo desde la raíz de esa versión (por
+ejemplo un `git worktree`), con las variables de benchmarks/fakes.py y, para versiones que
+consultan SQLite al importar, una data/sqlite/cierre.db sintética.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def perfil_importacion(modulo: str) -> list:
+    """Retorna [(acumulado_us, propio_us, paquete)] ordenado por tiempo acumulado."""
+    proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                             capture_output=True, text=True, env=os.environ)
+    if proceso.returncode != 0:
+        raise RuntimeError(proceso.stderr.strip().splitlines()[-1])
+    filas = []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, paquete = linea[len("import time:"):].split("|", 2)
+        filas.append((int(acumulado), int(propio), paquete.rstrip()))
+    return sorted(filas, reverse=True)
+
+
+def arranque_en_frio(modulo: str, repeticiones: int) -> float:
+    """Mediana en segundos de importar el módulo en un proceso nuevo."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {modulo}"], check=True, env=os.environ,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modulo", default="src.QACierreCaliMemV2.agentDATALAKE")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    filas = perfil_importacion(args.modulo)
+    print(f"{'acumulado ms':>13}{'propio ms':>11}  paquete")
+    for acumulado, propio, paquete in filas[:args.top]:
+        print(f"{acumulado / 1000:>13.1f}{propio / 1000:>11.1f}  {paquete}")
+    pesados = ("pandas", "langchain", "langgraph", "openai", "sqlalchemy", "pyarrow")
+    cargados = sorted({p.strip().split(".")[0] for _, _, p in filas if p.strip().split(".")[0].startswith(pesados)})
+    print(f"\nPaquetes pesados importados: {', '.join(cargados) or 'ninguno'}")
+    print(f"Arranque en frío (mediana de {args.repeticiones}): {arranque_en_frio(args.modulo, args.repeticiones) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
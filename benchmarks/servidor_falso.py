@@ -0,0 +1,28 @@
+"""Aplicación de servidor_api con el modelo falso, para pruebas de carga con varios workers.
+
+Cada worker de uvicorn importa este módulo, configura el modelo falso y expone la misma `app`.
+El datalake falso lo levanta benchmarks/carga_api.py y se pasa por variables de entorno.
+"""
+import os
+import sys
+
+sys.path.append(".")
+from benchmarks.fakes import ENTORNO_FALSO, ModeloFalso
+
+for variable, valor in ENTORNO_FALSO.items():
+    os.environ.setdefault(variable, valor)
+
+from src.QACierreCaliMemV2 import agentDATALAKE
+from src.QACierreCaliMemV2.cache_respuestas import CacheRespuestas
+from src.QACierreCaliMemV2.enrutador import EnrutadorPreguntas
+from src.QACierreCaliMemV2.servidor_api import app  # noqa: F401
+
+fecha = os.environ["BENCH_ULTIMA_FECHA"]
+agentDATALAKE.configurar_llm(ModeloFalso(
+    guion=[[("obtener_datos_cierre_comercial", {"ultimos": 1}), ("obtener_datos_cierre_normativo", {"ultimos": 1})],
+           [("obtener_datos_tareas_mayor_duracion_por_fecha", {"fecha_cierre": fecha})]],
+    latencia=float(os.environ.get("BENCH_LATENCIA_LLM", "0.05")),
+    trabajo_cpu=float(os.environ.get("BENCH_TRABAJO_CPU", "0.02"))))
+# Sin enrutador ni cache de respuestas para que cada petición recorra el agente completo
+agentDATALAKE.enrutador = EnrutadorPreguntas(activo=False)
+agentDATALAKE.cache_respuestas = CacheRespuestas(max_entradas=0)
@@ -0,0 +1,93 @@
+"""Tokens de prompt por turno en una conversación larga, con y sin compactación del historial.
+
+Simula `--turnos` preguntas en una misma sesión de agentDATALAKE y de chain con el modelo y el
+datalake falsos de benchmarks/fakes.py. En cada turno el agente consulta el resumen comercial de
+los últimos 30 cierres y el detalle de tareas, como en una sesión ejecutiva real. Los tokens se
+toman de las trazas de cada turno (estimados por caracteres, el modelo falso no los informa).
+
+El modo "completo" desactiva la compactación (ventana y recorte sin límite) para comparar.
+Termina con código 1 si en el modo compactado el prompt de los últimos turnos supera en más
+de TOLERANCIA al del primer tercio de la conversación.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/tokens_historial.py --turnos 50
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(".")
+from benchmarks.fakes import ENTORNO_FALSO, ModeloFalso, ServidorDatalakeFalso, generar_datos
+
+#Variables que desactivan la compactación en el modo completo
+SIN_COMPACTAR = {"HISTORIAL_VENTANA_TURNOS": "100000", "HISTORIAL_TURNOS_CON_RESULTADOS": "100000",
+                 "HILO_MAX_MENSAJES": "100000"}
+#Crecimiento admitido del prompt compactado (el texto de cada pregunta varía un poco)
+TOLERANCIA = 0.05
+
+
+def tokens_por_turno(turnos: list) -> list:
+    """Prompt más grande de cada turno: la última llamada al modelo incluye los resultados del turno."""
+    return [max((s.get("tokens_prompt") or 0 for s in t["spans"] if s["tipo"] == "llm"), default=0) for t in turnos]
+
+
+def conversar(agente: str, turnos: int) -> list:
+    from benchmarks.bench_agentes import crear_base_sqlite, preparar_chain, preparar_datalake
+    from src.QACierreCaliMemV2 import trazas
+
+    datos = generar_datos(60, 200)
+    ultima = datos["ultima_fecha"].isoformat()
+    guion = [[("obtener_datos_cierre_comercial", {"ultimos": 30}), ("obtener_datos_cierre_normativo", {"ultimos": 30})],
+             [("obtener_datos_tareas_mayor_duracion_por_fecha", {"fecha_cierre": ultima})]]
+    respuesta = ("El cierre comercial finalizó a las 06:40, antes de la apertura de oficinas; la tarea de mayor "
+                 "duración fue la conciliación de cartera con 25 minutos y el normativo terminó a las 07:15.")
+    with ServidorDatalakeFalso(datos) as servidor:
+        os.environ.update(servidor.variables_entorno())
+        if agente == "datalake":
+            get_response, _ = preparar_datalake(ModeloFalso(guion=guion, respuesta=respuesta))
+        else:
+            ruta_db = os.path.join(tempfile.mkdtemp(), "cierre.db")
+            crear_base_sqlite(datos["detalle"], ruta_db)
+            get_response, _ = preparar_chain(ModeloFalso(respuesta=respuesta), f"sqlite:///{ruta_db}")
+        for i in range(turnos):
+            get_response(f"Pregunta {i + 1}: ¿cómo se compara el cierre del {ultima} con los anteriores?", "sesion-larga")
+    return tokens_por_turno([t for t in trazas.registro.turnos() if t["agente"] == agente])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turnos", type=int, default=50)
+    parser.add_argument("--agente", choices=["datalake", "chain", "todos"], default="todos")
+    parser.add_argument("--modo", choices=["compactado", "completo"], help="uso interno: un modo por proceso")
+    args = parser.parse_args()
+
+    if args.modo:
+        os.environ.update(ENTORNO_FALSO)
+        os.environ["CHECKPOINTER_DIR"] = tempfile.mkdtemp()
+        if args.modo == "completo":
+            os.environ.update(SIN_COMPACTAR)
+        print(",".join(str(t) for t in conversar(args.agente, args.turnos)))
+        return
+
+    # Cada modo en su propio proceso: la configuración de la compactación se lee al importar
+    agentes = ["datalake", "chain"] if args.agente == "todos" else [args.agente]
+    acotado = True
+    print(f"{'agente':<9}{'modo':<12}{'turno 1':>9}{'turno 10':>9}{'turno 25':>9}{'último':>9}{'máximo':>9}{'total':>10}")
+    for agente in agentes:
+        for modo in ("completo", "compactado"):
+            salida = subprocess.run([sys.executable, __file__, "--turnos", str(args.turnos), "--agente", agente,
+                                     "--modo", modo], capture_output=True, text=True, check=True)
+            tokens = [int(t) for t in salida.stdout.strip().splitlines()[-1].split(",")]
+            muestras = [tokens[min(i, len(tokens) - 1)] for i in (0, 9, 24, len(tokens) - 1)]
+            print(f"{agente:<9}{modo:<12}" + "".join(f"{m:>9}" for m in muestras) + f"{max(tokens):>9}{sum(tokens):>10}")
+            if modo == "compactado":
+                tercio = max(1, len(tokens) // 3)
+                acotado &= max(tokens[-tercio:]) <= max(tokens[:tercio]) * (1 + TOLERANCIA)
+    print(f"Prompt acotado en el modo compactado: {'sí' if acotado else 'no'}")
+    sys.exit(0 if acotado else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+python -m uvicorn src.QACierreCaliMemV2.servidor_api:app --host 0.0.0.0 --port 8001 --workers 4
\ No newline at end of file
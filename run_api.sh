@@ -0,0 +1,2 @@
+#!/bin/bash
+python -m uvicorn src.QACierreCaliMemV2.servidor_api:app --host 0.0.0.0 --port 8001 --workers ${API_WORKERS:-4}
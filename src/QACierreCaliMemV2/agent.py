@@ -1,51 +1,47 @@
 from datetime import date
-from langchain_groq  import ChatGroq
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
+from typing import Optional
 #from langchain_community.utilities.sql_database import SQLDatabase
 #from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from sqlalchemy import create_engine
-from sqlalchemy import text
+import threading
 
 
 
 from dotenv import load_dotenv
+import sys
 
 load_dotenv()
 
-#Conexión de base de datos
-engine = create_engine("sqlite:///data/sqlite/cierre.db")
+sys.path.append(".")
+from src.QACierreCaliMemV2.filtros_contexto import preparar_salida
+from src.QACierreCaliMemV2 import trazas
 
+#La base de datos, el modelo y el agente se crean en el primer uso
 
-def obtener_datos_por_proceso_de_cierre() ->str:
-    """Retorna los datos del proceso de cierre para todas las fechas disponibles específica en formato json
-        con los siguientes campos:
+
+@trazas.medir_herramienta
+def obtener_datos_por_proceso_de_cierre(fecha_desde: Optional[date] = None, fecha_hasta: Optional[date] = None,
+                                        ultimos: Optional[int] = None, campos: Optional[list[str]] = None) ->str:
+    """Retorna los datos del proceso de cierre en formato json con los siguientes campos:
                FECHA_CIERRE: fecha del cierre
                DURACION_TOTAL: duración de todo el proceso de cierre de cada fecha
                DURACION_SIN_PAUSAS: duración de las tareas de cierre sin contar las pausas
                INICIO_CIERRE: Fecha y hora de inicio del cierre
                FIN_CIERRE: Fecha y hora de fin de todo del cierre
                HORA_HABILITAR_MENU: Fecha y hora en que finalizó la tarea de habilitar menú lo que permite abrir oficinas
+        Si la información no cabe completa, las fechas más antiguas se entregan resumidas en un registro FECHAS_OMITIDAS.
+
         Args:
-            fecha_cierre: fecha de cierre, Opcional. 
+            fecha_desde: fecha de cierre inicial, Opcional. Para una sola fecha use la misma en fecha_desde y fecha_hasta
+            fecha_hasta: fecha de cierre final, Opcional.
+            ultimos: cantidad de cierres más recientes a retornar, Opcional.
+            campos: lista de campos a retornar, Opcional. Por defecto todos.
     """
-    query= """select FECHA_CIERRE, TIME(SUM( DURACION), 'unixepoch') as DURACION_TOTAL_CIERRE,  TIME(SUM(IIF(CODIGO_TAREA=='PAUSA',0,DURACION)),'unixepoch') AS DURACION_CIERRE_SIN_PAUSAS,
-            DATETIME( min(INICIO)) as INICIO_CIERRE, DATETIME( max(FIN)) as FIN_CIERRE, DATETIME(MAX(IIF(DESCRIPCION_TAREA='Habilita accesos al menu',FIN,0))) AS FECHA_HABILITAR_MENU
-            from Cierre 
-            WHERE FECHA_CIERRE IS NOT NULL
-            group by FECHA_CIERRE """
-    
-    context= "["
-    with engine.connect() as connection:
-        result = connection.execute(text(query))
-     #   print([c[0] for c in result.cursor.description])
-        for row in result:
-            context += f'{{"FECHA_CIERRE":"{row[0]},"DURACION_TOTAL":"{row[1]}", "DURACION_SIN_PAUSAS":"{row[2]}", "INICIO_CIERRE":"{row[3]}", "FIN_CIERRE":"{row[4]}", HORA_HABILITAR_MENU:"{row[5]}"}}, '
-    context += "]"
-    return context
+    from src.QACierreCaliMemV2.repositorio_cierre import obtener_repositorio
+    return preparar_salida(obtener_repositorio().resumen(), fecha_desde, fecha_hasta, ultimos, campos)
 
 ###########
 # funciones para ser invocadas por el modelo
+@trazas.medir_herramienta
 def obtener_datos_tareas_mayor_duracion_por_fecha(fecha_cierre:date) ->str:
     """Retorna los detalles las tareas con mayor duración no tienen información del cierre completo 
     solamente de las 10 tareas de mayor duracion
@@ -59,20 +55,8 @@ def obtener_datos_tareas_mayor_duracion_por_fecha(fecha_cierre:date) ->str:
         Args:
             fecha_cierre: fecha de cierre 
     """
-    query= """select FECHA_CIERRE, TIME( DURACION, 'unixepoch') as DURACION, CODIGO_TAREA, DESCRIPCION_TAREA,
-                DATETIME(INICIO) as INICIO, DATETIME( FIN) as FIN
-                from Cierre 
-                WHERE FECHA_CIERRE = """
-    query += "'" + fecha_cierre.strftime("%Y-%m-%d") + "'"
-    query += " order by DURACION desc LIMIT 10"        
-        
-    context= "["
-    with engine.connect() as connection:
-        result = connection.execute(text(query))
-        for row in result:
-            context += f'{{"FECHA_CIERRE":"{row[0]},"DURACION":"{row[1]}", "CODIGO_TAREA":"{row[2]}", "DESCRIPCION_TAREA":"{row[3]}", "INICIO":"{row[4]}", "FIN":"{row[5]}"}}, '
-    context += "]"
-    return context
+    from src.QACierreCaliMemV2.repositorio_cierre import obtener_repositorio, a_json
+    return a_json(obtener_repositorio().tareas_mayor_duracion(fecha_cierre, 10))
 
 
 
@@ -83,8 +67,6 @@ def obtener_datos_tareas_mayor_duracion_por_fecha(fecha_cierre:date) ->str:
 #
 grop_model ="llama3-groq-70b-8192-tool-use-preview"
 
-llm = ChatGroq(model=grop_model, temperature=0,verbose=True)
-
 tools=[obtener_datos_por_proceso_de_cierre, obtener_datos_tareas_mayor_duracion_por_fecha]
 
 
@@ -99,17 +81,66 @@ system_message = """"Eres un asistente muy útil. Por favor entraga solamente la
               Responde siempre en español
             """
 
-memory = MemorySaver()
 config = {"configurable": {"thread_id": "1"}}
 
-agent_executor = create_react_agent(
-    llm, tools=tools, state_modifier=system_message,debug=False, checkpointer=memory
-)
+_candado = threading.Lock()
+_llm = None
+_gestor_hilos = None
+_agent_executor = None
+
+
+def obtener_llm():
+    global _llm
+    with _candado:
+        if _llm is None:
+            from langchain_groq  import ChatGroq
+            _llm = ChatGroq(model=grop_model, temperature=0,verbose=True)
+        return _llm
+
+
+def configurar_llm(llm, herramientas: list = None):
+    """Reemplaza el modelo (y opcionalmente las herramientas) del agente; se recrea en el siguiente uso."""
+    global _llm, _agent_executor, tools
+    with _candado:
+        _llm = llm
+        if herramientas is not None:
+            tools = herramientas
+        _agent_executor = None
+
+
+def obtener_gestor_hilos():
+    global _gestor_hilos
+    with _candado:
+        if _gestor_hilos is None:
+            from src.QACierreCaliMemV2.memoria_hilos import crear_checkpointer, GestorHilos
+            _gestor_hilos = GestorHilos(crear_checkpointer("hilos_sqlite"))
+        return _gestor_hilos
+
+
+def obtener_agente():
+    global _agent_executor
+    llm = obtener_llm()
+    gestor_hilos = obtener_gestor_hilos()
+    with _candado:
+        if _agent_executor is None:
+            from langgraph.prebuilt import create_react_agent
+            from src.QACierreCaliMemV2.memoria_hilos import crear_modificador_estado
+            _agent_executor = create_react_agent(
+                llm, tools=tools, state_modifier=crear_modificador_estado(system_message),debug=False, checkpointer=gestor_hilos.checkpointer
+            )
+        return _agent_executor
 
 
 def get_response(user_input):
+    from src.QACierreCaliMemV2.manejador_trazas import ManejadorTrazas
+
+    agent_executor = obtener_agente()
+    gestor_hilos = obtener_gestor_hilos()
     inputs = {"messages": [("user", user_input)]}
-    response = agent_executor.invoke(inputs, config=config)
+    with trazas.turno("sqlite", config["configurable"]["thread_id"]) as turno:
+        response = agent_executor.invoke(inputs, config=dict(config, callbacks=[ManejadorTrazas(turno)]))
+    gestor_hilos.registrar_uso(config["configurable"]["thread_id"])
+    gestor_hilos.recortar(agent_executor, config)
     #for m in response["messages"]:
     #        m.pretty_print()
     message = response["messages"][-1]
@@ -127,7 +158,7 @@ def main():
             break
 
         inputs = {"messages": [("user", user_input)]}
-        response = agent_executor.stream(inputs,config=config)
+        response = obtener_agente().stream(inputs,config=config)
         print(type(response))
         for s in response:
             for key in s.keys():
@@ -1,14 +1,15 @@
 from datetime import date
-import pandas as pd
-from langchain_groq  import ChatGroq
-from langchain_openai   import AzureChatOpenAI
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
-from io import StringIO
+from typing import Optional
+import asyncio
 import logging
-import requests
 import os
+import sys
+import threading
 from dotenv import load_dotenv
+import orjson
+
+#pandas, langchain y langgraph se importan en el primer uso para que importar el módulo
+#(por ejemplo desde pages/Datos_Cierre.py) no pague su carga ni la creación del agente
 
 # Configure logging level from environment variable
 log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -24,77 +25,81 @@ logging.info(f'cargando modulo - log_level{log_level}')
 
 load_dotenv()
 
+sys.path.append(".")
+from src.QACierreCaliMemV2.cache_datalake import cache
+from src.QACierreCaliMemV2.filtros_contexto import estimar_tokens, preparar_salida
+from src.QACierreCaliMemV2.cache_respuestas import cache_respuestas
+from src.QACierreCaliMemV2.enrutador import enrutador
+from src.QACierreCaliMemV2 import trazas
+
+
+def _tokens_blob(recurso: str) -> int:
+    """Tokens del blob completo, lo que las herramientas entregaban antes de filtrar en el espejo."""
+    contenido = cache.obtener(recurso)
+    return estimar_tokens(contenido.decode("utf-8")) if contenido is not None else None
 
 
-def obtener_datos_cierre_normativo() ->str:
-    """Retorna los datos del cierre normativo para todas las fechas disponibles específica en formato json
-        con los siguientes campos:
+@trazas.medir_herramienta
+def obtener_datos_cierre_normativo(fecha_desde: Optional[date] = None, fecha_hasta: Optional[date] = None,
+                                   ultimos: Optional[int] = None, campos: Optional[list[str]] = None) ->str:
+    """Retorna los datos del cierre normativo en formato json con los siguientes campos:
                FECHA_CIERRE: fecha del cierre
                FIN_BANDEJA4: fecha y hora en la que está disponible la información para enviar a la Super Intendencia Financiera
                FIN_BANDEJA8: fecha y hora en la finaliza todo el cierre normativo
+        Si la información no cabe completa, las fechas más antiguas se entregan resumidas en un registro FECHAS_OMITIDAS.
 
         Args:
-            fecha_cierre: fecha de cierre, Opcional. 
+            fecha_desde: fecha de cierre inicial, Opcional. Para una sola fecha use la misma en fecha_desde y fecha_hasta
+            fecha_hasta: fecha de cierre final, Opcional.
+            ultimos: cantidad de cierres más recientes a retornar, Opcional.
+            campos: lista de campos a retornar, Opcional. Por defecto todos.
     """
-    try:
-        myurl = os.environ["RESUMEN_CIERE_NORMATIVO_URL"]+"?"+os.environ["AZURE_DATALAKE_GENAI_TOKEN"]
-
-        response = requests.get(myurl)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        context = response.text
-        return context
-    except KeyError as e:
-        logging.error(f"Error with env variables RESUMEN_CIERE_NORMATIVO_URL or KEY")
-        return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching data from RESUMEN_CIERE_NORMATIVO_URL: {e}")
+    from src.QACierreCaliMemV2.espejo_columnar import espejo
+    registros = espejo.registros("normativo", fecha_desde, fecha_hasta, ultimos)
+    if not registros and espejo.version("normativo") is None:
         return None
+    return preparar_salida(registros, campos=campos, originales=_tokens_blob(espejo.conjuntos["normativo"][0]))
 
 
 def df_cierre_comercial():
-    #Leer archivo
+    """Retorna el DataFrame del resumen comercial compartido por todas las sesiones; no se debe modificar."""
+    from src.QACierreCaliMemV2.snapshot_cierre import proveedor_snapshot
     try:
-        myurl = os.environ["RESUMEN_CIERRE_URL"]+"?"+os.environ["AZURE_DATALAKE_GENAI_TOKEN"]
-   
-        response = requests.get(myurl)
-        response.raise_for_status()
-        context = response.text
-        #crear dataframe
-        df:pd.DataFrame=pd.read_json(StringIO(context))
-        #Formatear fecha y duraciones 
-        df["FECHA_CIERRE"]=df.FECHA_CIERRE.str.slice(0,10)
-        df["Duración Total"]= df.DURACION_TOTAL_CIERRE_SEGUNDOS/60/60
-        df["Sin Pausas"]= df.DURACION_SIN_PAUSAS_SEGUNDOS/60/60
-        df["Total Pausas"]=  df["Duración Total"]-df["Sin Pausas"]
-        return df
-    except (requests.exceptions.RequestException, pd.errors.EmptyDataError, KeyError) as e:
+        snapshot = proveedor_snapshot.obtener()
+        if snapshot is None:
+            return None
+        return snapshot.df
+    except (ValueError, KeyError, AttributeError) as e:
         logging.error(f"Error processing cierre comercial data: {e}")
         return None
 
 
-def obtener_datos_cierre_comercial() ->str:
-    """Retorna los datos del proceso de cierre comercial para todas las fechas disponibles específica en formato json
-        con los siguientes campos:
+@trazas.medir_herramienta
+def obtener_datos_cierre_comercial(fecha_desde: Optional[date] = None, fecha_hasta: Optional[date] = None,
+                                   ultimos: Optional[int] = None, campos: Optional[list[str]] = None) ->str:
+    """Retorna los datos del proceso de cierre comercial en formato json con los siguientes campos:
                FECHA_CIERRE: fecha del cierre
                DURACION_TOTAL: duración de todo el proceso de cierre de cada fecha
                DURACION_SIN_PAUSAS: duración de las tareas de cierre sin contar las pausas
                INICIO_CIERRE: Fecha y hora de inicio del cierre
                FIN_CIERRE: Fecha y hora de fin de todo del cierre
                HORA_HABILITAR_MENU: Fecha y hora en que finalizó la tarea de habilitar menú lo que permite abrir oficinas. Cuando de este dato puntualice si se logró antes de las 8:00 am o no
+        Si la información no cabe completa, las fechas más antiguas se entregan resumidas en un registro FECHAS_OMITIDAS.
+
         Args:
-            fecha_cierre: fecha de cierre, Opcional. 
+            fecha_desde: fecha de cierre inicial, Opcional. Para una sola fecha use la misma en fecha_desde y fecha_hasta
+            fecha_hasta: fecha de cierre final, Opcional.
+            ultimos: cantidad de cierres más recientes a retornar, Opcional.
+            campos: lista de campos a retornar, Opcional. Por defecto todos.
     """
-    myurl = os.environ["RESUMEN_CIERRE_URL"]+"?"+os.environ["AZURE_DATALAKE_GENAI_TOKEN"]
-    try:
-        response = requests.get(myurl)
-        response.raise_for_status()
-        context = response.text
-        return context
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching data from {myurl}: {e}")
+    from src.QACierreCaliMemV2.espejo_columnar import espejo
+    registros = espejo.registros("comercial", fecha_desde, fecha_hasta, ultimos)
+    if not registros and espejo.version("comercial") is None:
         return None
+    return preparar_salida(registros, campos=campos, originales=_tokens_blob(espejo.conjuntos["comercial"][0]))
 
 
+@trazas.medir_herramienta
 def obtener_datos_tareas_mayor_duracion_por_fecha(fecha_cierre:date) ->str:
     """Retorna los detalles las tareas con mayor duración no tienen información del cierre completo 
     solamente de las 10 tareas de mayor duracion del cierre comercial
@@ -108,25 +113,67 @@ def obtener_datos_tareas_mayor_duracion_por_fecha(fecha_cierre:date) ->str:
         Args:
             fecha_cierre: fecha de cierre 
     """
-    myurl = os.environ["DETALLE_TAREAS_URL"]+"?"+os.environ["AZURE_DATALAKE_GENAI_TOKEN"]
+    from src.QACierreCaliMemV2.espejo_columnar import espejo
     try:
-        df=pd.read_parquet(myurl)
-        context= df[df.FECHA_CIERRE == fecha_cierre].sort_values(by='DURACION_SEGUNDOS' ,ascending=False).head(10).to_json(orient='records')
+        context= orjson.dumps(espejo.mayor_duracion(fecha_cierre, 10), default=str).decode("utf-8")
         return context
-    except (pd.errors.EmptyDataError, KeyError, FileNotFoundError) as e:
+    except (KeyError, ValueError) as e:
         logging.error(f"Error fetching or processing task data for {fecha_cierre}: {e}")
         return None
 
 
 
-#### Configuración del modelo y herramientas
-llm= AzureChatOpenAI(
-    azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"]
-    ,azure_deployment= os.environ["AZURE_OPENAI_DEPLOYMENT"]
-    ,temperature=0
-    ,verbose=False)
+@trazas.medir_herramienta
+def obtener_estadisticas_cierre_comercial(fecha_desde: Optional[date] = None, fecha_hasta: Optional[date] = None,
+                                          ultimos: Optional[int] = None) ->str:
+    """Retorna estadísticas ya calculadas del cierre comercial en formato json. Úsela para promedios,
+    percentiles, cierres más lentos, tendencias y para contar los días en que habilitar menú terminó
+    después de la hora de apertura de oficinas (8:00 am), en lugar de calcularlos con los datos de cada fecha.
+        Los campos son:
+               DESDE, HASTA, CIERRES: rango de fechas y cantidad de cierres considerados
+               DURACION_TOTAL, DURACION_SIN_PAUSAS: PROMEDIO, P50 (mediana), P90, MINIMO y MAXIMO en HH:MM:SS
+               MEDIAS_MOVILES: promedio de duración y días con menú tarde en los últimos 7 y 30 cierres hasta HASTA
+               DIAS_MENU_DESPUES_DE_APERTURA: cantidad de cierres en que habilitar menú terminó después de las 8:00 am
+               FECHAS_MENU_DESPUES_DE_APERTURA: los 10 más recientes de esos cierres con la hora y el retraso
+               CIERRES_MAS_LENTOS: los 5 cierres de mayor duración total
+
+        Args:
+            fecha_desde: fecha de cierre inicial, Opcional.
+            fecha_hasta: fecha de cierre final, Opcional.
+            ultimos: cantidad de cierres más recientes a considerar, Opcional.
+    """
+    from src.QACierreCaliMemV2.analitica_cierre import analitica
+    estadisticas = analitica.estadisticas_comercial(fecha_desde, fecha_hasta, ultimos)
+    if estadisticas is None:
+        return None
+    return orjson.dumps(estadisticas, default=str).decode("utf-8")
+
+
+@trazas.medir_herramienta
+def obtener_anomalias_tareas(fecha_desde: Optional[date] = None, fecha_hasta: Optional[date] = None,
+                             ultimos: Optional[int] = None) ->str:
+    """Retorna en formato json las tareas del cierre comercial cuya duración fue anómala frente a su
+    historia (z-score de 3 o más desviaciones estándar), de la más a la menos anómala. Úsela para
+    preguntas sobre tareas inusualmente lentas o rápidas o sobre la causa de un retraso.
+        Los campos son:
+               FECHA_CIERRE: fecha del cierre
+               CODIGO_TAREA, DESCRIPCION_TAREA: tarea
+               DURACION: duración de la tarea en ese cierre
+               DURACION_PROMEDIO: duración promedio de la tarea en los demás cierres
+               Z: desviaciones estándar respecto al promedio; positivo es más lenta de lo normal
+
+        Args:
+            fecha_desde: fecha de cierre inicial, Opcional. Para una sola fecha use la misma en fecha_desde y fecha_hasta
+            fecha_hasta: fecha de cierre final, Opcional.
+            ultimos: cantidad de cierres más recientes a considerar, Opcional.
+    """
+    from src.QACierreCaliMemV2.analitica_cierre import analitica
+    anomalias = analitica.anomalias_tareas(fecha_desde, fecha_hasta, ultimos)
+    if anomalias is None:
+        return None
+    return orjson.dumps(anomalias, default=str).decode("utf-8")
+
 
-tools=[obtener_datos_cierre_comercial, obtener_datos_tareas_mayor_duracion_por_fecha, obtener_datos_cierre_normativo]
 
 fecha_hoy=f" La fecha actual es {date.today().strftime('%Y-%m-%d')}"
 
@@ -147,52 +194,251 @@ system_message_1shot = """"Eres un asistente muy útil y tienes acceso a la info
               No respondas preguntas sobre temas diferentes al cierre comercial y el normativo
             """ + fecha_hoy
 
-memory = MemorySaver()
+#### Configuración del modelo, herramientas y agente (creados en el primer uso)
+_candado = threading.Lock()
+_llm = None
+_tools = None
+_gestor_hilos = None
+_agent_executor = None
+
+
+def crear_herramienta(funcion):
+    """Expone la función como herramienta con variante async; la E/S bloqueante corre en un hilo
+    para que las llamadas paralelas que pide el modelo en un mismo paso se solapen."""
+    from langchain_core.tools import StructuredTool
+
+    async def acorrutina(**kwargs):
+        return await asyncio.to_thread(funcion, **kwargs)
+    return StructuredTool.from_function(func=funcion, coroutine=acorrutina)
+
+
+def obtener_llm():
+    global _llm
+    with _candado:
+        if _llm is None:
+            from langchain_openai import AzureChatOpenAI
+            _llm= AzureChatOpenAI(
+                azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"]
+                ,azure_deployment= os.environ["AZURE_OPENAI_DEPLOYMENT"]
+                ,temperature=0
+                ,verbose=False)
+        return _llm
+
+
+def configurar_llm(llm):
+    """Reemplaza el modelo del agente (por ejemplo por uno falso en benchmarks); el agente se recrea en el siguiente uso."""
+    global _llm, _agent_executor
+    with _candado:
+        _llm = llm
+        _agent_executor = None
+
+
+def obtener_herramientas() -> list:
+    global _tools
+    with _candado:
+        if _tools is None:
+            _tools=[crear_herramienta(f) for f in (obtener_datos_cierre_comercial, obtener_datos_tareas_mayor_duracion_por_fecha, obtener_datos_cierre_normativo,
+                                                              obtener_estadisticas_cierre_comercial, obtener_anomalias_tareas)]
+        return _tools
+
+
+def obtener_gestor_hilos():
+    global _gestor_hilos
+    with _candado:
+        if _gestor_hilos is None:
+            from src.QACierreCaliMemV2.memoria_hilos import crear_checkpointer, GestorHilos
+            _gestor_hilos = GestorHilos(crear_checkpointer("hilos_datalake"))
+        return _gestor_hilos
+
+
+def obtener_agente():
+    global _agent_executor
+    llm = obtener_llm()
+    tools = obtener_herramientas()
+    gestor_hilos = obtener_gestor_hilos()
+    with _candado:
+        if _agent_executor is None:
+            from langgraph.prebuilt import create_react_agent
+            from src.QACierreCaliMemV2.memoria_hilos import crear_modificador_estado
+            _agent_executor = create_react_agent(
+                llm, tools=tools, state_modifier=crear_modificador_estado(system_message_1shot),debug=False, checkpointer=gestor_hilos.checkpointer
+            )
+        return _agent_executor
+
+
+def _contenido(message) -> str:
+    if isinstance(message,tuple):
+        return(message[1])
+    else:
+        return message.content
+
+
+#Recursos cuya versión invalida la cache de respuestas
+RECURSOS_RESUMEN = ["RESUMEN_CIERRE_URL", "RESUMEN_CIERE_NORMATIVO_URL"]
+
+
+def _respuesta_directa(user_input, config):
+    """Responde sin el ciclo del agente cuando se puede: primero con el enrutador de preguntas
+    frecuentes y luego con la cache de respuestas. Si hay respuesta la agrega al hilo para que
+    la conversación siga teniendo contexto, y el hilo se registra y recorta como en el ciclo del
+    agente. Retorna (respuesta, huella, con_historial); con_historial indica si el hilo ya tenía
+    turnos, que la cache de respuestas necesita para no compartir respuestas que dependen de ellos."""
+    huella = cache.huella(RECURSOS_RESUMEN)
+    con_historial = False
+    respuesta = enrutador.responder(user_input)
+    if respuesta is not None:
+        trazas.anotar(ruta="enrutador")
+        logging.info(f"Respuesta directa del enrutador, tasa de aciertos {enrutador.tasa_aciertos():.0%}")
+    else:
+        con_historial = bool(obtener_agente().get_state(config).values.get("messages"))
+        respuesta = cache_respuestas.buscar(user_input, huella, con_historial=con_historial)
+        if respuesta is not None:
+            trazas.anotar(ruta="cache_respuestas")
+    if respuesta is not None:
+        from langchain_core.messages import AIMessage, HumanMessage
+        agent_executor = obtener_agente()
+        gestor_hilos = obtener_gestor_hilos()
+        agent_executor.update_state(config, {"messages": [HumanMessage(user_input), AIMessage(respuesta)]}, as_node="agent")
+        gestor_hilos.registrar_uso(config["configurable"]["thread_id"])
+        gestor_hilos.recortar(agent_executor, config)
+    return respuesta, huella, con_historial
+
+
+def _guardar_respuesta(user_input, huella, con_historial, mensaje):
+    """Guarda en la cache de respuestas solo una respuesta final con texto: no una llamada a
+    herramienta pendiente ni una respuesta vacía, que se servirían después como si fueran válidas."""
+    from langchain_core.messages import AIMessage
+    if not isinstance(mensaje, AIMessage) or mensaje.tool_calls:
+        return
+    respuesta = _contenido(mensaje)
+    if isinstance(respuesta, str) and respuesta.strip():
+        cache_respuestas.guardar(user_input, huella, respuesta, con_historial=con_historial)
+
+
+def _con_trazas(config, turno):
+    """Config de la invocación con el callback que registra en el turno las llamadas al modelo."""
+    from src.QACierreCaliMemV2.manejador_trazas import ManejadorTrazas
+    return dict(config, callbacks=[ManejadorTrazas(turno)])
 
-agent_executor = create_react_agent(
-    llm, tools=tools, state_modifier=system_message_1shot,debug=False, checkpointer=memory
-)
 
 #Función para obtener última respuesta del agente
 def get_response(user_input,thread_id):
     try:
-        config = {"configurable": {"thread_id": thread_id}}
-        inputs = {"messages": [("user", user_input)]}
-        response = agent_executor.invoke(inputs, config=config)
-        for m in response["messages"]:
-            logging.debug(f"{m}")
-        message = response["messages"][-1]
-        if isinstance(message,tuple):
-            return(message[1])
-        else:
-            return message.content
+        with trazas.turno("datalake", thread_id) as turno:
+            config = {"configurable": {"thread_id": thread_id}}
+            respuesta, huella, con_historial = _respuesta_directa(user_input, config)
+            if respuesta is not None:
+                return respuesta
+            agent_executor = obtener_agente()
+            gestor_hilos = obtener_gestor_hilos()
+            inputs = {"messages": [("user", user_input)]}
+            response = agent_executor.invoke(inputs, config=_con_trazas(config, turno))
+            gestor_hilos.registrar_uso(thread_id)
+            gestor_hilos.recortar(agent_executor, config)
+            for m in response["messages"]:
+                logging.debug(f"{m}")
+            _guardar_respuesta(user_input, huella, con_historial, response["messages"][-1])
+            return _contenido(response["messages"][-1])
     except Exception as e:
         logging.exception(f"An error occurred during agent execution: {e}")
         return "An unexpected error occurred."
 
 
-def main():
+#Variante async: las herramientas pedidas en un mismo paso se ejecutan de forma concurrente
+async def aget_response(user_input,thread_id):
+    try:
+        with trazas.turno("datalake", thread_id) as turno:
+            config = {"configurable": {"thread_id": thread_id}}
+            respuesta, huella, con_historial = await asyncio.to_thread(_respuesta_directa, user_input, config)
+            if respuesta is not None:
+                return respuesta
+            agent_executor = obtener_agente()
+            gestor_hilos = obtener_gestor_hilos()
+            inputs = {"messages": [("user", user_input)]}
+            response = await agent_executor.ainvoke(inputs, config=_con_trazas(config, turno))
+            gestor_hilos.registrar_uso(thread_id)
+            await gestor_hilos.arecortar(agent_executor, config)
+            for m in response["messages"]:
+                logging.debug(f"{m}")
+            _guardar_respuesta(user_input, huella, con_historial, response["messages"][-1])
+            return _contenido(response["messages"][-1])
+    except Exception as e:
+        logging.exception(f"An error occurred during agent execution: {e}")
+        return "An unexpected error occurred."
+
+
+#Generador de eventos para mostrar la respuesta a medida que se produce
+def stream_response(user_input,thread_id):
+    """Genera tuplas (tipo, contenido) mientras el agente trabaja:
+        ("herramienta", nombre) cuando el modelo solicita una herramienta
+        ("token", texto) con cada fragmento de la respuesta
+    """
+    try:
+        # El turno solo se activa mientras se produce cada evento, el consumidor puede estar en otro contexto
+        with trazas.turno("datalake", thread_id, activo=False) as turno:
+            config = {"configurable": {"thread_id": thread_id}}
+            with trazas.activar(turno):
+                respuesta, huella, con_historial = _respuesta_directa(user_input, config)
+            if respuesta is not None:
+                yield ("token", respuesta)
+                return
+            agent_executor = obtener_agente()
+            gestor_hilos = obtener_gestor_hilos()
+            inputs = {"messages": [("user", user_input)]}
+            partes = []
+            eventos = agent_executor.stream(inputs, config=_con_trazas(config, turno), stream_mode="messages")
+            for message, metadata in trazas.iterar(turno, eventos):
+                if metadata.get("langgraph_node") != "agent":
+                    continue
+                for llamada in getattr(message, "tool_call_chunks", None) or []:
+                    if llamada.get("name"):
+                        # El texto previo a una llamada a herramienta no es la respuesta final
+                        partes = []
+                        yield ("herramienta", llamada["name"])
+                if isinstance(message.content, str) and message.content:
+                    partes.append(message.content)
+                    yield ("token", message.content)
+            # Solo se llega aquí si el stream terminó: si el consumidor lo abandona, el generador se cierra antes
+            final = agent_executor.get_state(config).values.get("messages", [])
+            if partes and final:
+                _guardar_respuesta(user_input, huella, con_historial, final[-1])
+            gestor_hilos.registrar_uso(thread_id)
+            gestor_hilos.recortar(agent_executor, config)
+    except Exception as e:
+        logging.exception(f"An error occurred during streaming response: {e}")
+        yield ("token", "An unexpected error occurred.")
+
+
+async def amain():
     config = {"configurable": {"thread_id": "1"}}
-    df=df_cierre_comercial()
-    print(df.head(2))
-    user_input = ""
     while True:
-        user_input=input("Ingrese la pregunta (/q para finalizar): \n")
+        user_input = await asyncio.to_thread(input, "Ingrese la pregunta (/q para finalizar): \n")
         if user_input.startswith("/q"):
             break
         try:
+            agent_executor = obtener_agente()
+            gestor_hilos = obtener_gestor_hilos()
             inputs = {"messages": [("user", user_input)]}
-            response = agent_executor.stream(inputs,config=config)
-            for s in response:
+            async for s in agent_executor.astream(inputs,config=config):
                 for key in s.keys():
                     message=s[key]['messages'][-1]
                     if isinstance(message,tuple):
                         print(message)
                     else:
                         message.pretty_print()
+            gestor_hilos.registrar_uso(config["configurable"]["thread_id"])
+            await gestor_hilos.arecortar(agent_executor, config)
         except Exception as e:
             logging.exception(f"An error occurred during streaming response: {e}")
 
 
+def main():
+    from src.QACierreCaliMemV2.refrescador import iniciar_refrescador
+    iniciar_refrescador()
+    df=df_cierre_comercial()
+    print(df.head(2))
+    asyncio.run(amain())
+
+
 if __name__ == "__main__":
     main()
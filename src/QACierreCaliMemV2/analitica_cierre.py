@@ -0,0 +1,258 @@
+from datetime import date, timedelta
+import logging
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.espejo_columnar import espejo, EspejoColumnar
+from src.QACierreCaliMemV2.enrutador import HORA_APERTURA
+
+
+#Ventanas de las medias móviles, en número de cierres
+VENTANAS_MOVILES = [int(v) for v in os.environ.get("ANALITICA_VENTANAS", "7,30").split(",") if v.strip()]
+#Desviaciones estándar desde las que la duración de una tarea se considera anómala
+UMBRAL_Z = float(os.environ.get("ANALITICA_UMBRAL_Z", "3"))
+#Cierres previos con la tarea necesarios para calcular su z-score
+MIN_HISTORIA = int(os.environ.get("ANALITICA_MIN_HISTORIA", "5"))
+
+COLUMNAS_COMERCIAL = ["FECHA_CIERRE", "DURACION_TOTAL_CIERRE_SEGUNDOS", "DURACION_SIN_PAUSAS_SEGUNDOS", "HORA_HABILITAR_MENU"]
+COLUMNAS_TAREAS = ["FECHA_CIERRE", "CODIGO_TAREA", "DESCRIPCION_TAREA", "DURACION_SEGUNDOS"]
+
+
+def _hhmmss(segundos) -> str:
+    """Duración en formato HH:MM:SS; las horas pueden pasar de 24."""
+    if segundos is None or pd.isna(segundos):
+        return None
+    segundos = int(round(segundos))
+    return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+def _fechas(columna: pd.Series) -> pd.Series:
+    return pd.to_datetime(columna.astype(str).str.slice(0, 10)).dt.date
+
+
+def _pendientes_desde(huellas_espejo: dict, procesadas: dict):
+    """Primera fecha a recalcular según las huellas por fecha del espejo (nueva o con otra huella).
+    Retorna (desde, completo); completo indica que hay que recalcular todo porque aún no se procesó
+    nada o el espejo ya no tiene alguna fecha procesada. Sin completo y con desde None no cambió nada."""
+    if not procesadas or procesadas.keys() - huellas_espejo.keys():
+        return None, True
+    cambiadas = [f for f, huella in huellas_espejo.items() if procesadas.get(f) != huella]
+    return (min(cambiadas) if cambiadas else None), False
+
+
+class AnaliticaCierre:
+    """Estadísticas precalculadas sobre la historia de cierres del espejo columnar.
+
+    Mantiene una serie diaria del cierre comercial (duraciones, retraso de habilitar menú frente a
+    la hora de apertura de oficinas, medias móviles e incumplimientos acumulados por ventana) y, del
+    detalle de tareas, la duración de cada código de tarea por fecha con sus sumas por código
+    (n, suma, suma de cuadrados). Cuando cambia la versión de un conjunto solo se procesan las
+    fechas nuevas o corregidas (según `EspejoColumnar.huellas`) y se ajustan las sumas, sin recorrer
+    la historia completa. Las consultas son
+    operaciones vectorizadas sobre esas estructuras y entregan resultados compactos para el modelo.
+    """
+
+    def __init__(self, espejo_columnar: EspejoColumnar = espejo, ventanas: list = None,
+                 hora_apertura=HORA_APERTURA, min_historia: int = MIN_HISTORIA):
+        self.espejo = espejo_columnar
+        self.ventanas = ventanas or VENTANAS_MOVILES
+        self.hora_apertura = hora_apertura
+        self.min_historia = min_historia
+        self._versiones = {}
+        self._huellas = {}
+        self._diario = None
+        self._tareas = None
+        self._acumulados = None
+        self._candado = threading.Lock()
+
+    def _metricas_diarias(self, df: pd.DataFrame) -> pd.DataFrame:
+        diario = pd.DataFrame({
+            "FECHA_CIERRE": _fechas(df.FECHA_CIERRE),
+            "TOTAL_S": pd.to_numeric(df.DURACION_TOTAL_CIERRE_SEGUNDOS, errors="coerce"),
+            "SIN_PAUSAS_S": pd.to_numeric(df.DURACION_SIN_PAUSAS_SEGUNDOS, errors="coerce"),
+        })
+        menu = pd.to_datetime(df.HORA_HABILITAR_MENU.astype(str).str.slice(0, 19).str.replace("T", " "), errors="coerce")
+        limite = pd.to_datetime(diario.FECHA_CIERRE) + timedelta(days=1, hours=self.hora_apertura.hour,
+                                                                 minutes=self.hora_apertura.minute)
+        diario["HORA_HABILITAR_MENU"] = menu
+        diario["RETRASO_MENU_S"] = (menu - limite).dt.total_seconds().clip(lower=0)
+        # Igual que el enrutador: cumple si habilitar menú terminó antes de la hora de apertura
+        diario["MENU_TARDE"] = (menu >= limite).astype("int8")
+        return diario.sort_values("FECHA_CIERRE").drop_duplicates("FECHA_CIERRE", keep="last")
+
+    def _moviles(self, diario: pd.DataFrame, inicio: int) -> pd.DataFrame:
+        """Calcula las columnas móviles desde la fila `inicio`; las anteriores ya están calculadas
+        y solo se usan como contexto de la ventana."""
+        contexto = max(0, inicio - max(self.ventanas) + 1)
+        tramo = diario.iloc[contexto:]
+        for ventana in self.ventanas:
+            columnas = {f"MEDIA_{ventana}_TOTAL_S": tramo.TOTAL_S.rolling(ventana, min_periods=1).mean(),
+                        f"MEDIA_{ventana}_SIN_PAUSAS_S": tramo.SIN_PAUSAS_S.rolling(ventana, min_periods=1).mean(),
+                        f"MENU_TARDE_{ventana}": tramo.MENU_TARDE.rolling(ventana, min_periods=1).sum()}
+            for columna, serie in columnas.items():
+                if columna not in diario:
+                    diario[columna] = np.nan
+                diario.loc[diario.index[inicio:], columna] = serie.iloc[inicio - contexto:].to_numpy()
+        return diario
+
+    def _actualizar_comercial(self):
+        version = self.espejo.version("comercial")
+        if version is None or version == self._versiones.get("comercial"):
+            return
+        anterior = self._diario
+        huellas = self.espejo.huellas("comercial")
+        desde, completo = _pendientes_desde(huellas, self._huellas.get("comercial", {}) if anterior is not None else {})
+        self._huellas["comercial"] = huellas
+        self._versiones["comercial"] = version
+        if not completo and desde is None:
+            return
+        tabla = self.espejo.tabla("comercial", fecha_desde=desde, columnas=COLUMNAS_COMERCIAL)
+        nuevas = self._metricas_diarias(tabla.to_pandas()) if tabla is not None else None
+        base = None if completo else anterior[anterior.FECHA_CIERRE < desde]
+        partes = [p for p in (base, nuevas) if p is not None and len(p)]
+        self._diario = None
+        if partes:
+            diario = pd.concat(partes, ignore_index=True)
+            self._diario = self._moviles(diario, len(base) if base is not None else 0)
+        logging.info(f"Analítica comercial: {len(nuevas) if nuevas is not None else 0} fechas procesadas, "
+                     f"{len(self._diario) if self._diario is not None else 0} en total")
+
+    @staticmethod
+    def _sumas(tareas: pd.DataFrame) -> pd.DataFrame:
+        return (tareas.assign(CUADRADO=tareas.DURACION_SEGUNDOS ** 2)
+                .groupby("CODIGO_TAREA")
+                .agg(n=("DURACION_SEGUNDOS", "size"), suma=("DURACION_SEGUNDOS", "sum"), suma2=("CUADRADO", "sum")))
+
+    def _actualizar_tareas(self):
+        version = self.espejo.version("tareas")
+        if version is None or version == self._versiones.get("tareas"):
+            return
+        anterior = self._tareas
+        huellas = self.espejo.huellas("tareas")
+        desde, completo = _pendientes_desde(huellas, self._huellas.get("tareas", {}) if anterior is not None else {})
+        self._huellas["tareas"] = huellas
+        self._versiones["tareas"] = version
+        if not completo and desde is None:
+            return
+        tabla = self.espejo.tabla("tareas", fecha_desde=desde, columnas=COLUMNAS_TAREAS)
+        if tabla is not None and not {"CODIGO_TAREA", "DURACION_SEGUNDOS"} <= set(tabla.column_names):
+            logging.warning("El espejo de tareas no tiene CODIGO_TAREA y DURACION_SEGUNDOS, no hay analítica de tareas")
+            tabla = None
+        nuevas = None
+        if tabla is not None:
+            df = tabla.to_pandas()
+            df["FECHA_CIERRE"] = _fechas(df.FECHA_CIERRE)
+            if "DESCRIPCION_TAREA" not in df:
+                df["DESCRIPCION_TAREA"] = None
+            # Una tarea puede ejecutarse varias veces en un cierre (por ejemplo PAUSA): se suma por fecha
+            nuevas = (df.groupby(["FECHA_CIERRE", "CODIGO_TAREA"], as_index=False, sort=True)
+                      .agg(DURACION_SEGUNDOS=("DURACION_SEGUNDOS", "sum"), DESCRIPCION_TAREA=("DESCRIPCION_TAREA", "first")))
+            nuevas["DURACION_SEGUNDOS"] = nuevas.DURACION_SEGUNDOS.astype("float64")
+        if completo or anterior is None:
+            base, acumulados = None, None
+        else:
+            reemplazadas = anterior[anterior.FECHA_CIERRE >= desde]
+            base = anterior[anterior.FECHA_CIERRE < desde]
+            acumulados = self._acumulados.sub(self._sumas(reemplazadas), fill_value=0)
+        if nuevas is not None and len(nuevas):
+            sumas = self._sumas(nuevas)
+            acumulados = sumas if acumulados is None else acumulados.add(sumas, fill_value=0)
+        partes = [p for p in (base, nuevas) if p is not None and len(p)]
+        self._tareas = pd.concat(partes, ignore_index=True) if partes else None
+        self._acumulados = acumulados[acumulados.n > 0] if acumulados is not None else None
+        logging.info(f"Analítica de tareas: {len(nuevas) if nuevas is not None else 0} filas procesadas")
+
+    def actualizar(self):
+        """Incorpora las fechas nuevas o corregidas del espejo; sin cambios de versión no hace nada."""
+        if (self._versiones.get("comercial") == self.espejo.version("comercial")
+                and self._versiones.get("tareas") == self.espejo.version("tareas")):
+            return
+        with self._candado:
+            self._actualizar_comercial()
+            self._actualizar_tareas()
+
+    @staticmethod
+    def _rango(df: pd.DataFrame, fecha_desde: date = None, fecha_hasta: date = None, ultimos: int = None) -> pd.DataFrame:
+        seleccion = np.ones(len(df), dtype=bool)
+        if fecha_desde is not None:
+            seleccion &= (df.FECHA_CIERRE >= fecha_desde).to_numpy()
+        if fecha_hasta is not None:
+            seleccion &= (df.FECHA_CIERRE <= fecha_hasta).to_numpy()
+        df = df[seleccion]
+        if ultimos:
+            fechas = sorted(set(df.FECHA_CIERRE))[-ultimos:]
+            df = df[df.FECHA_CIERRE >= fechas[0]] if fechas else df
+        return df
+
+    @staticmethod
+    def _distribucion(serie: pd.Series) -> dict:
+        serie = serie.dropna()
+        if serie.empty:
+            return None
+        return {"PROMEDIO": _hhmmss(serie.mean()), "P50": _hhmmss(serie.quantile(0.5)),
+                "P90": _hhmmss(serie.quantile(0.9)), "MINIMO": _hhmmss(serie.min()), "MAXIMO": _hhmmss(serie.max())}
+
+    def estadisticas_comercial(self, fecha_desde: date = None, fecha_hasta: date = None,
+                               ultimos: int = None, mas_lentos: int = 5) -> dict:
+        """Resumen estadístico del cierre comercial en el rango, o None si no hay cierres."""
+        self.actualizar()
+        diario = self._diario
+        if diario is None:
+            return None
+        rango = self._rango(diario, fecha_desde, fecha_hasta, ultimos)
+        if rango.empty:
+            return None
+        ultimo = rango.iloc[-1]
+        tarde = rango[rango.MENU_TARDE == 1]
+        lentos = rango.nlargest(mas_lentos, "TOTAL_S")
+        return {
+            "DESDE": rango.FECHA_CIERRE.iloc[0], "HASTA": ultimo.FECHA_CIERRE, "CIERRES": len(rango),
+            "DURACION_TOTAL": self._distribucion(rango.TOTAL_S),
+            "DURACION_SIN_PAUSAS": self._distribucion(rango.SIN_PAUSAS_S),
+            "MEDIAS_MOVILES": {f"ULTIMOS_{v}_CIERRES": {"DURACION_TOTAL": _hhmmss(ultimo[f"MEDIA_{v}_TOTAL_S"]),
+                                                         "DURACION_SIN_PAUSAS": _hhmmss(ultimo[f"MEDIA_{v}_SIN_PAUSAS_S"]),
+                                                         "MENU_DESPUES_DE_APERTURA": int(ultimo[f"MENU_TARDE_{v}"])}
+                               for v in self.ventanas},
+            "HORA_APERTURA_OFICINAS": f"{self.hora_apertura:%H:%M}",
+            "DIAS_MENU_DESPUES_DE_APERTURA": len(tarde),
+            "FECHAS_MENU_DESPUES_DE_APERTURA": [{"FECHA_CIERRE": f, "HORA_HABILITAR_MENU": h, "RETRASO": _hhmmss(r)}
+                                                for f, h, r in zip(tarde.FECHA_CIERRE, tarde.HORA_HABILITAR_MENU,
+                                                                   tarde.RETRASO_MENU_S)][-10:],
+            "CIERRES_MAS_LENTOS": [{"FECHA_CIERRE": f, "DURACION_TOTAL": _hhmmss(t), "DURACION_SIN_PAUSAS": _hhmmss(s)}
+                                   for f, t, s in zip(lentos.FECHA_CIERRE, lentos.TOTAL_S, lentos.SIN_PAUSAS_S)],
+        }
+
+    def anomalias_tareas(self, fecha_desde: date = None, fecha_hasta: date = None, ultimos: int = None,
+                         umbral: float = UMBRAL_Z, limite: int = 10) -> list:
+        """Tareas cuya duración en un cierre del rango se aleja `umbral` desviaciones estándar o más
+        de su duración en los demás cierres, de mayor a menor z-score. None si no hay detalle de tareas."""
+        self.actualizar()
+        tareas, acumulados = self._tareas, self._acumulados
+        if tareas is None or acumulados is None:
+            return None
+        rango = self._rango(tareas, fecha_desde, fecha_hasta, ultimos)
+        if rango.empty:
+            return []
+        sumas = acumulados.reindex(rango.CODIGO_TAREA).to_numpy()
+        x = rango.DURACION_SEGUNDOS.to_numpy()
+        # Estadísticos de los demás cierres de la tarea: se descuenta el propio de las sumas
+        n = sumas[:, 0] - 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            media = (sumas[:, 1] - x) / n
+            varianza = (sumas[:, 2] - x ** 2 - n * media ** 2) / (n - 1)
+            z = (x - media) / np.sqrt(varianza)
+        validas = (n >= self.min_historia) & (varianza > 0) & (np.abs(z) >= umbral)
+        anomalas = rango[validas].assign(Z=z[validas], MEDIA=media[validas])
+        anomalas = anomalas.reindex(anomalas.Z.abs().sort_values(ascending=False).index).head(limite)
+        return [{"FECHA_CIERRE": f, "CODIGO_TAREA": c, "DESCRIPCION_TAREA": d, "DURACION": _hhmmss(s),
+                 "DURACION_PROMEDIO": _hhmmss(m), "Z": round(float(zz), 1)}
+                for f, c, d, s, m, zz in zip(anomalas.FECHA_CIERRE, anomalas.CODIGO_TAREA, anomalas.DESCRIPCION_TAREA,
+                                             anomalas.DURACION_SEGUNDOS, anomalas.MEDIA, anomalas.Z)]
+
+
+analitica = AnaliticaCierre()
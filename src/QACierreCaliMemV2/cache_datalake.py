@@ -0,0 +1,227 @@
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import orjson
+import requests
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.cliente_datalake import cliente, construir_url, ClienteDatalake
+from src.QACierreCaliMemV2 import trazas
+
+
+#Tiempo de vida en segundos de una copia en cache antes de revalidarla contra el datalake
+TTL_SEGUNDOS = float(os.environ.get("DATALAKE_CACHE_TTL", "300"))
+#Directorio donde se persisten las copias y sus validadores; vacío para no persistir
+DIRECTORIO = os.environ.get("DATALAKE_CACHE_DIR", "data/espejo/blobs")
+#Fracción del TTL que se espera antes de volver a intentar cuando el datalake no responde
+FRACCION_REINTENTO = float(os.environ.get("DATALAKE_CACHE_FRACCION_REINTENTO", "0.1"))
+
+
+def escribir_atomico(ruta: str, contenido: bytes):
+    """Escribe el archivo completo o no lo modifica: se escribe a un temporal y se reemplaza."""
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+    except OSError:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+class EntradaCache:
+    """Última copia válida de un recurso junto con sus validadores HTTP."""
+
+    def __init__(self, contenido: bytes, etag: str, last_modified: str):
+        self.contenido = contenido
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validado = time.monotonic()
+        self.json = None
+
+    def vigente(self, ttl: float) -> bool:
+        return time.monotonic() - self.validado < ttl
+
+    def version(self) -> str:
+        # crc32 y no hash(): hash() de bytes cambia en cada proceso y daría una versión nueva al reiniciar
+        return self.etag or self.last_modified or f"crc32:{zlib.crc32(self.contenido):08x}"
+
+
+class CacheDatalake:
+    """Cache en proceso de los archivos del datalake, compartida por herramientas y páginas.
+
+    Cada recurso se identifica por el nombre de su variable de entorno. Mientras la copia esté
+    dentro del TTL se sirve desde memoria; al vencer se revalida con If-None-Match /
+    If-Modified-Since, de modo que un blob sin cambios solo cuesta un 304. Si el datalake
+    no está disponible se sigue sirviendo la última copia buena, y no se vuelve a consultar hasta
+    que pase una fracción del TTL, para no esperar los reintentos en cada llamada durante la caída.
+
+    Con `solo_memoria` activo (lo activa el refrescador en segundo plano) las copias existentes
+    se sirven sin revalidar; solo `refrescar` consulta el datalake.
+
+    Con `directorio` cada descarga se guarda en disco con su ETag y Last-Modified. Al reiniciar
+    el proceso la copia en disco se carga vencida, así la primera consulta es una revalidación
+    condicional (304) y no una descarga completa.
+    """
+
+    def __init__(self, ttl: float = TTL_SEGUNDOS, cliente_datalake: ClienteDatalake = cliente,
+                 directorio: str = DIRECTORIO):
+        self.ttl = ttl
+        self.cliente = cliente_datalake
+        self.directorio = directorio
+        self.solo_memoria = False
+        self._entradas: dict[str, EntradaCache] = {}
+        self._candados: dict[str, threading.Lock] = {}
+        self._candado = threading.Lock()
+        self.estadisticas = {"aciertos": 0, "revalidados": 0, "descargas": 0, "obsoletos": 0}
+
+    def _contar(self, evento: str):
+        self.estadisticas[evento] += 1
+        trazas.contar(f"cache_{evento}")
+
+    def _candado_recurso(self, recurso: str) -> threading.Lock:
+        with self._candado:
+            return self._candados.setdefault(recurso, threading.Lock())
+
+    def _ruta(self, recurso: str, extension: str) -> str:
+        return os.path.join(self.directorio, f"{recurso}.{extension}")
+
+    def _entrada(self, recurso: str) -> EntradaCache:
+        """Entrada en memoria del recurso o, si no la hay, la última copia persistida en disco."""
+        entrada = self._entradas.get(recurso)
+        if entrada is not None or not self.directorio:
+            return entrada
+        try:
+            with open(self._ruta(recurso, "json"), "rb") as archivo:
+                validadores = orjson.loads(archivo.read())
+            with open(self._ruta(recurso, "blob"), "rb") as archivo:
+                contenido = archivo.read()
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        entrada = EntradaCache(contenido, validadores.get("etag"), validadores.get("last_modified"))
+        entrada.validado = float("-inf")
+        with self._candado:
+            return self._entradas.setdefault(recurso, entrada)
+
+    def _persistir(self, recurso: str, entrada: EntradaCache):
+        if not self.directorio:
+            return
+        try:
+            escribir_atomico(self._ruta(recurso, "blob"), entrada.contenido)
+            escribir_atomico(self._ruta(recurso, "json"),
+                             orjson.dumps({"etag": entrada.etag, "last_modified": entrada.last_modified}))
+        except OSError as e:
+            logging.warning(f"No se pudo persistir la copia de {recurso}: {e}")
+
+    def obtener(self, recurso: str) -> bytes:
+        """Retorna el contenido del recurso, revalidándolo solo si venció el TTL.
+        Retorna None si nunca se pudo descargar."""
+        entrada = self._entrada(recurso)
+        if entrada is not None and (self.solo_memoria or entrada.vigente(self.ttl)):
+            self._contar("aciertos")
+            return entrada.contenido
+        # Un solo hilo revalida cada recurso; los demás esperan y reutilizan el resultado
+        with self._candado_recurso(recurso):
+            entrada = self._entradas.get(recurso)
+            if entrada is not None and entrada.vigente(self.ttl):
+                self._contar("aciertos")
+                return entrada.contenido
+            return self._revalidar(recurso, entrada)
+
+    def refrescar(self, recurso: str) -> bool:
+        """Revalida el recurso contra el datalake sin importar el TTL.
+        Retorna True si la versión cambió. La entrada nueva reemplaza a la anterior de forma atómica."""
+        with self._candado_recurso(recurso):
+            anterior = self._entrada(recurso)
+            self._revalidar(recurso, anterior)
+            return self._entradas.get(recurso) is not anterior
+
+    def obtener_texto(self, recurso: str) -> str:
+        contenido = self.obtener(recurso)
+        if contenido is None:
+            return None
+        return contenido.decode("utf-8")
+
+    def obtener_json(self, recurso: str):
+        """Retorna el contenido del recurso decodificado como JSON.
+        El resultado se conserva mientras no cambie la versión del blob; no se debe modificar."""
+        contenido = self.obtener(recurso)
+        if contenido is None:
+            return None
+        entrada = self._entradas.get(recurso)
+        if entrada is None or entrada.contenido is not contenido:
+            return orjson.loads(contenido)
+        if entrada.json is None:
+            entrada.json = orjson.loads(contenido)
+        return entrada.json
+
+    def version(self, recurso: str) -> str:
+        """Identificador de la versión en cache del recurso (ETag o Last-Modified)."""
+        entrada = self._entradas.get(recurso)
+        if entrada is None:
+            return None
+        return entrada.version()
+
+    def huella(self, recursos: list) -> str:
+        """Huella de la versión actual de varios recursos; cambia cuando cambia cualquiera de ellos."""
+        for recurso in recursos:
+            self.obtener(recurso)
+        return "|".join(str(self.version(recurso)) for recurso in recursos)
+
+    def invalidar(self, recurso: str = None):
+        """Descarta la copia en memoria de un recurso, o de todos si no se indica ninguno.
+        Si hay copia en disco se vuelve a cargar y se revalida en el siguiente uso."""
+        with self._candado:
+            if recurso is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(recurso, None)
+
+    def _revalidar(self, recurso: str, entrada: EntradaCache) -> bytes:
+        try:
+            myurl = construir_url(recurso)
+        except KeyError as e:
+            logging.error(f"Error with env variables {recurso} or KEY: {e}")
+            return entrada.contenido if entrada is not None else None
+
+        headers = {}
+        if entrada is not None:
+            if entrada.etag:
+                headers["If-None-Match"] = entrada.etag
+            if entrada.last_modified:
+                headers["If-Modified-Since"] = entrada.last_modified
+        try:
+            response = self.cliente.get(myurl, headers=headers)
+            if response.status_code == 304 and entrada is not None:
+                entrada.validado = time.monotonic()
+                self._contar("revalidados")
+                return entrada.contenido
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        except requests.exceptions.RequestException as e:
+            if entrada is not None:
+                logging.warning(f"Datalake no disponible para {recurso}, se usa la última copia: {e}")
+                self._contar("obsoletos")
+                # La copia queda vigente por FRACCION_REINTENTO del TTL antes del siguiente intento
+                entrada.validado = time.monotonic() - self.ttl * (1 - FRACCION_REINTENTO)
+                return entrada.contenido
+            logging.error(f"Error fetching data from {recurso}: {e}")
+            return None
+
+        self._contar("descargas")
+        entrada = EntradaCache(
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"))
+        self._entradas[recurso] = entrada
+        self._persistir(recurso, entrada)
+        return response.content
+
+
+cache = CacheDatalake()
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from datetime import date
+import math
+import os
+import re
+import sys
+import threading
+import zlib
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.fechas import resolver_fecha, sin_tildes
+from src.QACierreCaliMemV2.enrutador import INTENCIONES
+
+
+#Configuración de la cache de respuestas
+UMBRAL_SIMILITUD = float(os.environ.get("CACHE_RESPUESTAS_UMBRAL", "0.9"))
+MAX_ENTRADAS = int(os.environ.get("CACHE_RESPUESTAS_MAX", "500"))
+DIMENSIONES = 2 ** 16
+
+#Rasgos que cambian la respuesta aunque el texto sea casi igual; dos preguntas solo se consideran
+#similares si tienen los mismos (además de los mismos números: bandeja, top N, horas)
+RASGOS = {
+    **INTENCIONES,
+    "mayor": re.compile(r"\b(mayor|mas larg\w*|maxim\w*|lent\w*|peor)\b"),
+    "menor": re.compile(r"\b(menor|mas cort\w*|minim\w*|rapid\w*|mejor)\b"),
+    "promedio": re.compile(r"\b(promedio|media)\b"),
+    "pausas": re.compile(r"\bpausas?\b"),
+    "tareas": re.compile(r"\btareas?\b"),
+    "negacion": re.compile(r"\bno\b"),
+}
+#Preguntas que se apoyan en turnos anteriores ("¿y la bandeja 8?", "¿y eso por qué?"); no se cachean
+DEPENDE_CONTEXTO = re.compile(r"^(y|e|entonces|pero|tambien|y si)\b|\b(eso|esa|ese|esos|esas|esto|anterior|"
+                              r"anteriores|mismo|misma|mismos|mismas|dicho|dicha|lo de|la de|el de)\b")
+
+
+def normalizar(pregunta: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios simples."""
+    texto = sin_tildes(pregunta.lower())
+    texto = re.sub(r"[^\w\s/-]", " ", texto)
+    return " ".join(texto.split())
+
+
+def firma(texto: str) -> frozenset:
+    """Números y rasgos de la pregunta normalizada que deben coincidir para reutilizar una respuesta."""
+    numeros = {f"#{n}" for n in re.findall(r"\d+", texto)}
+    return frozenset(numeros | {nombre for nombre, patron in RASGOS.items() if patron.search(texto)})
+
+
+def depende_contexto(texto: str) -> bool:
+    """Indica si la pregunta normalizada se refiere a turnos anteriores de la conversación."""
+    return bool(DEPENDE_CONTEXTO.search(texto))
+
+
+def vector_hash(texto: str) -> dict:
+    """Embedding local por hashing de palabras y trigramas de caracteres, normalizado (L2).
+    No requiere modelo ni red; crc32 hace que el vector sea estable entre procesos."""
+    vector = {}
+    for palabra in texto.split():
+        rasgos = [palabra] + [palabra[i:i + 3] for i in range(max(1, len(palabra) - 2))]
+        for rasgo in rasgos:
+            indice = zlib.crc32(rasgo.encode("utf-8")) % DIMENSIONES
+            vector[indice] = vector.get(indice, 0.0) + 1.0
+    norma = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+    return {k: v / norma for k, v in vector.items()}
+
+
+def similitud(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class CacheRespuestas:
+    """Cache de respuestas del agente para preguntas repetidas.
+
+    La clave es la pregunta normalizada junto con la fecha de cierre que resuelve, así
+    "¿cómo fue el cierre de ayer?" no reutiliza la respuesta de otro día. Primero se busca
+    la pregunta exacta y luego la más similar por embedding con la misma fecha y la misma
+    `firma` (números, bandeja, inicio/fin, mayor/menor...), porque preguntas como "bandeja 4"
+    y "bandeja 8" son casi idénticas en texto y tienen respuestas distintas. Las preguntas que
+    dependen de turnos anteriores no se buscan ni se guardan: la clave no incluye el hilo. Tampoco
+    las preguntas sin fecha hechas en un hilo con turnos anteriores (`con_historial`), porque
+    el agente puede tomar la fecha de la conversación ("¿a qué hora se habilitó el menú?").
+    Todas las entradas se descartan cuando cambia la huella de los datos del datalake.
+    """
+
+    def __init__(self, umbral: float = UMBRAL_SIMILITUD, max_entradas: int = MAX_ENTRADAS,
+                 embedder=vector_hash):
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.embedder = embedder
+        self._entradas = OrderedDict()
+        self._huella = None
+        self._candado = threading.Lock()
+        self.estadisticas = {"exactos": 0, "similares": 0, "fallos": 0, "invalidaciones": 0, "contextuales": 0}
+
+    def _clave(self, pregunta: str, hoy: date) -> tuple:
+        texto = normalizar(pregunta)
+        return (texto, resolver_fecha(pregunta, hoy), firma(texto))
+
+    def _contextual(self, clave: tuple, con_historial: bool) -> bool:
+        """True si la respuesta puede depender de turnos anteriores del hilo."""
+        return depende_contexto(clave[0]) or (con_historial and clave[1] is None)
+
+    def _validar_huella(self, huella: str):
+        if huella != self._huella:
+            if self._entradas:
+                self.estadisticas["invalidaciones"] += 1
+            self._entradas.clear()
+            self._huella = huella
+
+    def buscar(self, pregunta: str, huella: str, hoy: date = None, con_historial: bool = False) -> str:
+        """Retorna la respuesta guardada para la pregunta o None si no hay coincidencia."""
+        clave = self._clave(pregunta, hoy)
+        if self._contextual(clave, con_historial):
+            self.estadisticas["contextuales"] += 1
+            return None
+        with self._candado:
+            self._validar_huella(huella)
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self.estadisticas["exactos"] += 1
+                return entrada[1]
+            vector = self.embedder(clave[0])
+            mejor, puntaje = None, self.umbral
+            for (texto, fecha, rasgos), (vector_entrada, respuesta) in self._entradas.items():
+                if fecha != clave[1] or rasgos != clave[2]:
+                    continue
+                s = similitud(vector, vector_entrada)
+                if s >= puntaje:
+                    mejor, puntaje = respuesta, s
+            if mejor is not None:
+                self.estadisticas["similares"] += 1
+                return mejor
+            self.estadisticas["fallos"] += 1
+            return None
+
+    def guardar(self, pregunta: str, huella: str, respuesta: str, hoy: date = None, con_historial: bool = False):
+        clave = self._clave(pregunta, hoy)
+        if self._contextual(clave, con_historial):
+            return
+        vector = self.embedder(clave[0])
+        with self._candado:
+            self._validar_huella(huella)
+            self._entradas[clave] = (vector, respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def tasa_aciertos(self) -> float:
+        total = sum(self.estadisticas[k] for k in ("exactos", "similares", "fallos"))
+        if total == 0:
+            return 0.0
+        return (self.estadisticas["exactos"] + self.estadisticas["similares"]) / total
+
+
+cache_respuestas = CacheRespuestas()
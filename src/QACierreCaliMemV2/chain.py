@@ -1,8 +1,6 @@
 from langchain_core.prompts import  ChatPromptTemplate
-from langchain_groq import ChatGroq
-
-from sqlalchemy import create_engine
-from sqlalchemy import text
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.history import RunnableWithMessageHistory
 
 
 from langchain_community.chat_message_histories import ChatMessageHistory
@@ -10,43 +8,53 @@ from langchain_community.chat_message_histories import ChatMessageHistory
 
 from dotenv import load_dotenv
 
+from collections import OrderedDict
+import logging
+import os
 import sys
+import threading
 
 load_dotenv()
 
 sys.path.append(".")
-
-# Configuración del modelo
-llm = ChatGroq(model="mixtral-8x7b-32768")
-#configurar base de datos
-engine = create_engine("sqlite:///data/sqlite/cierre.db")
-query= """select FECHA_CIERRE, TIME(SUM( DURACION), 'unixepoch') as DURACION_TOTAL_CIERRE,  TIME(SUM(IIF(CODIGO_TAREA=='PAUSA',0,DURACION)),'unixepoch') AS DURACION_CIERRE_SIN_PAUSAS,
-                        DATETIME( min(INICIO)) as INICIO_CIERRE, DATETIME( max(FIN)) as FIN_CIERRE, DATETIME(MAX(IIF(DESCRIPCION_TAREA='Habilita accesos al menu',FIN,0))) AS FECHA_HABILITAR_MENU
-                    from Cierre c 
-                    WHERE FECHA_CIERRE IS NOT NULL
-                    group by FECHA_CIERRE 
-                  """
-
-
-
-context= ""
-with engine.connect() as connection:
-    result = connection.execute(text(query))
-    for row in result:
-        context += f"(FECHA_CIERRE={row[0]}, DURACION_TOTAL={row[1]}, DURACION_SIN_PAUSAS={row[2]}, INICIO_CIERRE={row[3]}, FIN_CIERRE={row[4]}, HORA_HABILITAR_MENU={row[5]}); "
-
-
-
-#Clase para gestionar memoria
-
-history = ChatMessageHistory()
-
-
-prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            """Eres un asistente muy útil. Por favor entraga solamente la respuesta a la pregunta de manera concreta.
+from src.QACierreCaliMemV2.repositorio_cierre import obtener_repositorio
+from src.QACierreCaliMemV2.filtros_contexto import filtrar_registros, ajustar_presupuesto, resumir_omitidos
+from src.QACierreCaliMemV2 import trazas
+from src.QACierreCaliMemV2.memoria_hilos import MAX_HILOS, MAX_MENSAJES, compactar_historial, indice_recorte
+
+# Configuración del modelo (se crea en el primer uso)
+_candado = threading.Lock()
+_llm = None
+_chain_with_message_history = None
+
+#Solo los cierres más recientes que caben en el presupuesto de tokens van en el prompt
+ULTIMOS_CIERRES = int(os.environ.get("CHAIN_ULTIMOS_CIERRES", "30"))
+MAX_TOKENS_CONTEXTO = int(os.environ.get("CHAIN_MAX_TOKENS_CONTEXTO", "3000"))
+
+
+def construir_contexto() -> str:
+    #configurar base de datos
+    registros, omitidos = ajustar_presupuesto(filtrar_registros(obtener_repositorio().resumen(), ultimos=ULTIMOS_CIERRES), MAX_TOKENS_CONTEXTO)
+    context= ""
+    if omitidos:
+        resumen = resumir_omitidos(omitidos)
+        context += f"(Hay {resumen['FECHAS_OMITIDAS']} cierres anteriores entre {resumen['DESDE']} y {resumen['HASTA']} que no se detallan); "
+    for row in registros:
+        context += f"(FECHA_CIERRE={row['FECHA_CIERRE']}, DURACION_TOTAL={row['DURACION_TOTAL']}, DURACION_SIN_PAUSAS={row['DURACION_SIN_PAUSAS']}, INICIO_CIERRE={row['INICIO_CIERRE']}, FIN_CIERRE={row['FIN_CIERRE']}, HORA_HABILITAR_MENU={row['HORA_HABILITAR_MENU']}); "
+    return context
+
+
+#Historial de cada sesión, del menos al más recientemente usado; se descartan los más antiguos sobre MAX_HILOS
+_historiales: OrderedDict[str, ChatMessageHistory] = OrderedDict()
+_candado_historiales = threading.Lock()
+
+
+def construir_prompt(context: str) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                """Eres un asistente muy útil. Por favor entraga solamente la respuesta a la pregunta de manera concreta.
                La respuesta es para altos ejecutivos que no concen el modelo de datos, 
                Aquí tienes la información sobre los procesos de cierre con los siguientes datos 
                FECHA_CIERRE: fecha del cierre
@@ -56,38 +64,77 @@ prompt = ChatPromptTemplate.from_messages(
                FIN_CIERRE: Fecha y hora de fin de todo del cierre
                HORA_HABILITAR_MENU: Fecha y hora en que finalizó la tarea de habilitar menú lo que permite abrir oficinas
             
-            """+ context + " no utilices los nombres de los campos en la respuesta, utiliza un lenguaje para ejecutivo",
-        ),
-        ("placeholder", "{chat_history}"),
-        ("human", "{input}"),
-    ]
-)
-
-chain = prompt | llm
-
-from langchain_core.runnables.history import RunnableWithMessageHistory
-
-
-chain_with_message_history = RunnableWithMessageHistory(
-    chain,
-    lambda session_id: history,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-)
-
-
-def get_history() -> ChatMessageHistory:
-    return history
-    
+                """+ context + " no utilices los nombres de los campos en la respuesta, utiliza un lenguaje para ejecutivo",
+            ),
+            ("placeholder", "{chat_history}"),
+            ("human", "{input}"),
+        ]
+    )
 
-def get_response(user_input):
 
-    
-    response =chain_with_message_history.invoke(
-        {"input": user_input},
-        {"configurable": {"session_id": "unused"}}
-    )
-    print(response)
+def obtener_llm():
+    global _llm
+    with _candado:
+        if _llm is None:
+            from langchain_groq import ChatGroq
+            _llm = ChatGroq(model="mixtral-8x7b-32768")
+        return _llm
+
+
+def configurar_llm(llm):
+    """Reemplaza el modelo de la cadena; se recrea en el siguiente uso."""
+    global _llm, _chain_with_message_history
+    with _candado:
+        _llm = llm
+        _chain_with_message_history = None
+
+
+def obtener_chain() -> RunnableWithMessageHistory:
+    global _chain_with_message_history
+    llm = obtener_llm()
+    with _candado:
+        if _chain_with_message_history is None:
+            #El modelo recibe el historial compactado: los turnos fuera de la ventana van resumidos
+            compactar = RunnableLambda(lambda entrada: dict(entrada, chat_history=compactar_historial(entrada["chat_history"])))
+            chain = compactar | construir_prompt(construir_contexto()) | llm
+            _chain_with_message_history = RunnableWithMessageHistory(
+                chain,
+                get_history,
+                input_messages_key="input",
+                history_messages_key="chat_history",
+            )
+        return _chain_with_message_history
+
+
+def get_history(session_id: str = "default") -> ChatMessageHistory:
+    with _candado_historiales:
+        historial = _historiales.get(session_id)
+        if historial is None:
+            historial = _historiales[session_id] = ChatMessageHistory()
+            while len(_historiales) > MAX_HILOS:
+                _historiales.popitem(last=False)
+        else:
+            _historiales.move_to_end(session_id)
+        return historial
+
+
+def recortar_historial(historial: ChatMessageHistory):
+    """Conserva solo los últimos MAX_MENSAJES mensajes de la sesión, cortando en una pregunta."""
+    corte = indice_recorte(historial.messages, MAX_MENSAJES)
+    if corte:
+        historial.messages = historial.messages[corte:]
+
+
+def get_response(user_input, session_id: str = "default"):
+    from src.QACierreCaliMemV2.manejador_trazas import ManejadorTrazas
+
+    with trazas.turno("chain", session_id) as turno:
+        response =obtener_chain().invoke(
+            {"input": user_input},
+            {"configurable": {"session_id": session_id}, "callbacks": [ManejadorTrazas(turno)]}
+        )
+    recortar_historial(get_history(session_id))
+    logging.debug(f"{response}")
     return response.content
 
 
@@ -0,0 +1,28 @@
+import os
+
+import orjson
+import requests
+
+
+#Cliente de la API del agente para usar Streamlit como cliente liviano (ver servidor_api.py)
+AGENTE_API_URL = os.environ.get("AGENTE_API_URL", "http://127.0.0.1:8001")
+TIMEOUT = (5, float(os.environ.get("AGENTE_API_TIMEOUT", "120")))
+
+session = requests.Session()
+
+
+def get_response(user_input,thread_id):
+    response = session.post(f"{AGENTE_API_URL}/respuesta", json={"pregunta": user_input, "thread_id": thread_id}, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.json()["respuesta"]
+
+
+def stream_response(user_input,thread_id):
+    """Mismos eventos (tipo, contenido) que agentDATALAKE.stream_response, leídos de la API."""
+    with session.post(f"{AGENTE_API_URL}/stream", json={"pregunta": user_input, "thread_id": thread_id},
+                      timeout=TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        for linea in response.iter_lines():
+            if linea:
+                evento = orjson.loads(linea)
+                yield (evento["tipo"], evento["contenido"])
@@ -0,0 +1,100 @@
+from collections import deque
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.append(".")
+from src.QACierreCaliMemV2 import trazas
+
+
+#Configuración del cliente HTTP del datalake
+TIMEOUT_CONEXION = float(os.environ.get("DATALAKE_TIMEOUT_CONEXION", "5"))
+TIMEOUT_LECTURA = float(os.environ.get("DATALAKE_TIMEOUT_LECTURA", "30"))
+REINTENTOS = int(os.environ.get("DATALAKE_REINTENTOS", "3"))
+BACKOFF = float(os.environ.get("DATALAKE_BACKOFF", "0.5"))
+POOL = int(os.environ.get("DATALAKE_POOL", "10"))
+TAMANO_BLOQUE = 1024 * 1024
+
+
+def construir_url(recurso: str) -> str:
+    """Construye la URL firmada (SAS) del recurso a partir de las variables de entorno.
+        Args:
+            recurso: nombre de la variable de entorno con la URL del blob, por ejemplo RESUMEN_CIERRE_URL
+    """
+    return os.environ[recurso]+"?"+os.environ["AZURE_DATALAKE_GENAI_TOKEN"]
+
+
+class ClienteDatalake:
+    """Cliente HTTP compartido para el datalake.
+
+    Reutiliza conexiones keep-alive con un requests.Session, aplica timeouts de conexión y
+    lectura a cada petición y reintenta con backoff exponencial los errores transitorios.
+    Registra la latencia y los bytes de cada petición en `metricas`.
+    """
+
+    def __init__(self, timeout_conexion: float = TIMEOUT_CONEXION, timeout_lectura: float = TIMEOUT_LECTURA,
+                 reintentos: int = REINTENTOS, backoff: float = BACKOFF, pool: int = POOL):
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.session = requests.Session()
+        retry = Retry(total=reintentos, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET", "HEAD"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # gzip se negocia siempre; requests descomprime la respuesta de forma transparente
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.metricas = deque(maxlen=1000)
+        self._candado = threading.Lock()
+        self.totales = {"peticiones": 0, "errores": 0, "bytes": 0, "segundos": 0.0}
+
+    def _registrar(self, url: str, estado: int, num_bytes: int, segundos: float):
+        recurso = url.split("?", 1)[0]
+        with self._candado:
+            self.metricas.append({"url": recurso, "estado": estado, "bytes": num_bytes, "segundos": segundos})
+            self.totales["peticiones"] += 1
+            self.totales["bytes"] += num_bytes
+            self.totales["segundos"] += segundos
+            if estado is None or estado >= 400:
+                self.totales["errores"] += 1
+        trazas.registrar_span("datalake", recurso.rsplit("/", 1)[-1], segundos, bytes=num_bytes, estado=estado)
+        trazas.contar("bytes_datalake", num_bytes)
+        logging.debug(f"GET {recurso} estado={estado} bytes={num_bytes} segundos={segundos:.3f}")
+
+    def get(self, url: str, headers: dict = None) -> requests.Response:
+        """Ejecuta un GET con timeouts y reintentos; el cuerpo queda cargado en memoria."""
+        inicio = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            self._registrar(url, None, 0, time.perf_counter() - inicio)
+            raise
+        self._registrar(url, response.status_code, len(response.content), time.perf_counter() - inicio)
+        return response
+
+    def descargar_a_archivo(self, url: str, destino: str, headers: dict = None) -> int:
+        """Descarga el recurso en streaming directamente a disco y retorna los bytes escritos."""
+        inicio = time.perf_counter()
+        num_bytes = 0
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            with open(destino, "wb") as archivo:
+                for bloque in response.iter_content(TAMANO_BLOQUE):
+                    archivo.write(bloque)
+                    num_bytes += len(bloque)
+        self._registrar(url, response.status_code, num_bytes, time.perf_counter() - inicio)
+        return num_bytes
+
+    def resumen_metricas(self) -> dict:
+        with self._candado:
+            return dict(self.totales)
+
+
+cliente = ClienteDatalake()
@@ -0,0 +1,186 @@
+from datetime import date, datetime, time as hora, timedelta
+import logging
+import os
+import re
+import sys
+import threading
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.cache_datalake import cache, CacheDatalake
+from src.QACierreCaliMemV2.fechas import resolver_fechas, sin_tildes
+
+
+#Respuestas directas a preguntas frecuentes sin pasar por el ciclo del agente
+ENRUTADOR_ACTIVO = os.environ.get("ENRUTADOR_PREGUNTAS", "1") != "0"
+HORA_APERTURA = hora.fromisoformat(os.environ.get("HORA_APERTURA_OFICINAS", "08:00"))
+
+#Intenciones reconocidas; una pregunta puede tener varias y la respuesta las combina
+INTENCIONES = {
+    "inicio": re.compile(r"\b(inici|comenz|empez|arranc)"),
+    "fin": re.compile(r"\b(finaliz|termin|acab)"),
+    "menu": re.compile(r"\b(menu|oficinas)\b"),
+    "bandeja4": re.compile(r"\bbandeja\s*4\b|\bsuper\s*intendencia\b|\bsfc\b"),
+    "bandeja8": re.compile(r"\bbandeja\s*8\b"),
+    "normativo": re.compile(r"\bnormativ"),
+    "comercial": re.compile(r"\bcomercial"),
+    "cierre": re.compile(r"\bcierre\b"),
+}
+#Palabras que indican preguntas de análisis, comparación o detalle de tareas: las responde el agente
+AMBIGUAS = re.compile(r"\b(tarea|tareas|promedio|compar\w*|mayor|menor|lent\w*|rapid\w*|semana|mes|"
+                      r"ultim\w*|entre|desde|por que|porque|tendencia|pausa|pausas|retras\w*)\b")
+#Pedido del resumen completo; una pregunta que solo menciona el cierre sin pedir un dato ni el resumen
+#("¿hubo errores en el cierre de ayer?") la responde el agente
+RESUMEN = re.compile(r"\b(como (fue|estuvo|salio|resulto|le fue|se dio)|resumen|resume|resumir|resumeme)\b")
+#Intenciones que piden un dato concreto del resumen
+DATOS = {"inicio", "fin", "menu", "bandeja4", "bandeja8"}
+
+
+def _fecha_hora(valor) -> datetime:
+    try:
+        return datetime.fromisoformat(str(valor)[:19].replace("T", " "))
+    except ValueError:
+        return None
+
+
+def _hora(valor) -> str:
+    """Formato "las 20:15 del 2024-05-06" para las respuestas; si no es fecha y hora se deja igual."""
+    momento = _fecha_hora(valor)
+    if momento is None:
+        return str(valor)
+    return f"las {momento:%H:%M} del {momento:%Y-%m-%d}"
+
+
+class EnrutadorPreguntas:
+    """Responde con plantillas las preguntas que solo requieren consultar un dato del resumen.
+
+    Reconoce la fecha (incluidas ayer y los días de la semana) y la intención: inicio y fin del
+    cierre comercial, habilitar menú antes de las 8:00, bandejas 4 y 8 del normativo y el resumen
+    completo cuando se pide explícitamente ("¿cómo fue el cierre de ayer?"). Las
+    respuestas siguen el estilo gerencial de system_message_1shot y se leen del resumen en
+    cache. Si la pregunta no menciona exactamente una fecha, pide análisis o el dato no está,
+    retorna None y la pregunta sigue al agente.
+    """
+
+    def __init__(self, cache_datalake: CacheDatalake = cache, activo: bool = ENRUTADOR_ACTIVO):
+        self.cache = cache_datalake
+        self.activo = activo
+        self._indices = {}
+        self._candado = threading.Lock()
+        self.estadisticas = {"directas": 0, "agente": 0}
+
+    def _registro(self, recurso: str, fecha: date) -> dict:
+        """Registro del resumen para la fecha; el índice por fecha se arma una vez por versión."""
+        version = self.cache.version(recurso)
+        indice = self._indices.get(recurso)
+        if indice is None or indice[0] != version or version is None:
+            registros = self.cache.obtener_json(recurso)
+            if registros is None:
+                return None
+            version = self.cache.version(recurso)
+            indice = (version, {str(r.get("FECHA_CIERRE"))[:10]: r for r in registros})
+            with self._candado:
+                self._indices[recurso] = indice
+        return indice[1].get(fecha.isoformat())
+
+    def intenciones(self, pregunta: str) -> set:
+        texto = " ".join(re.sub(r"[^\w\s]", " ", sin_tildes(pregunta.lower())).split())
+        if AMBIGUAS.search(texto):
+            return set()
+        encontradas = {nombre for nombre, patron in INTENCIONES.items() if patron.search(texto)}
+        # El normativo no tiene hora de inicio, y "fin del normativo" es la bandeja 8
+        if encontradas & {"normativo", "bandeja4", "bandeja8"}:
+            if "inicio" in encontradas:
+                return set()
+            if "fin" in encontradas and not encontradas & {"menu", "bandeja4"}:
+                encontradas = (encontradas - {"fin"}) | {"bandeja8"}
+            # "terminó la bandeja 4" pregunta por la bandeja, no por el fin del cierre comercial
+            if encontradas & {"bandeja4", "bandeja8"} and "comercial" not in encontradas:
+                encontradas.discard("fin")
+        if not encontradas & DATOS and not RESUMEN.search(texto):
+            return set()
+        especificas = encontradas - {"cierre", "comercial"}
+        if "comercial" in encontradas and not especificas & {"inicio", "fin", "menu"}:
+            especificas.add("cierre")
+        return especificas or encontradas & {"cierre"}
+
+    def _comercial(self, fecha: date, registro: dict, intenciones: set) -> str:
+        frases = []
+        completo = intenciones == {"cierre"}
+        if completo or {"inicio", "fin"} <= intenciones:
+            frases.append(f"El cierre comercial del {fecha} inició a {_hora(registro['INICIO_CIERRE'])} "
+                          f"y finalizó a {_hora(registro['FIN_CIERRE'])}.")
+        elif "inicio" in intenciones:
+            frases.append(f"El cierre comercial del {fecha} inició a {_hora(registro['INICIO_CIERRE'])}.")
+        elif "fin" in intenciones and "menu" not in intenciones:
+            frases.append(f"El cierre comercial del {fecha} finalizó a {_hora(registro['FIN_CIERRE'])}.")
+        if completo:
+            frases.append(f"La duración total fue {registro['DURACION_TOTAL']} y la duración sin pausas fue "
+                          f"{registro['DURACION_SIN_PAUSAS']}.")
+        if completo or "menu" in intenciones:
+            menu = _fecha_hora(registro["HORA_HABILITAR_MENU"])
+            if menu is None:
+                return None
+            limite = datetime.combine(fecha + timedelta(days=1), HORA_APERTURA)
+            if menu < limite:
+                impacto = f"dado que finalizó antes de las {HORA_APERTURA:%H:%M} am no impactó la apertura de oficinas"
+            else:
+                impacto = f"dado que finalizó después de las {HORA_APERTURA:%H:%M} am impactó la apertura de oficinas"
+            frases.append(f"La tarea de habilitar menú del cierre del {fecha} finalizó a "
+                          f"{_hora(registro['HORA_HABILITAR_MENU'])}, {impacto}.")
+        return " ".join(frases)
+
+    def _normativo(self, fecha: date, registro: dict, intenciones: set) -> str:
+        frases = []
+        if "bandeja8" in intenciones or "bandeja4" not in intenciones:
+            frases.append(f"El cierre normativo del {fecha} finalizó completamente a {_hora(registro['FIN_BANDEJA8'])}.")
+        if "bandeja4" in intenciones or "bandeja8" not in intenciones:
+            sujeto = "La información" if frases else f"La información del cierre normativo del {fecha}"
+            frases.append(f"{sujeto} para enviar a la Superintendencia Financiera estuvo disponible a "
+                          f"{_hora(registro['FIN_BANDEJA4'])}.")
+        return " ".join(frases)
+
+    def _componer(self, pregunta: str, hoy: date) -> str:
+        intenciones = self.intenciones(pregunta)
+        if not intenciones:
+            return None
+        fechas = resolver_fechas(pregunta, hoy)
+        if len(fechas) != 1:
+            return None
+        fecha = fechas[0]
+        normativas = intenciones & {"normativo", "bandeja4", "bandeja8"}
+        comerciales = intenciones - normativas
+        respuestas = []
+        if comerciales or not normativas:
+            registro = self._registro("RESUMEN_CIERRE_URL", fecha)
+            if registro is None:
+                return None
+            respuestas.append(self._comercial(fecha, registro, comerciales or {"cierre"}))
+        if normativas:
+            registro = self._registro("RESUMEN_CIERE_NORMATIVO_URL", fecha)
+            if registro is None:
+                return None
+            respuestas.append(self._normativo(fecha, registro, normativas))
+        if None in respuestas:
+            return None
+        return " ".join(respuestas)
+
+    def responder(self, pregunta: str, hoy: date = None) -> str:
+        """Retorna la respuesta directa a la pregunta o None si debe resolverla el agente."""
+        if not self.activo:
+            return None
+        try:
+            respuesta = self._componer(pregunta, hoy or date.today())
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Enrutador sin respuesta directa para '{pregunta}': {e}")
+            respuesta = None
+        self.estadisticas["directas" if respuesta is not None else "agente"] += 1
+        return respuesta
+
+    def tasa_aciertos(self) -> float:
+        total = self.estadisticas["directas"] + self.estadisticas["agente"]
+        if total == 0:
+            return 0.0
+        return self.estadisticas["directas"] / total
+
+
+enrutador = EnrutadorPreguntas()
@@ -0,0 +1,332 @@
+from contextlib import contextmanager
+from datetime import date
+from io import BytesIO
+import logging
+import os
+import shutil
+import sys
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.cache_datalake import cache, CacheDatalake, escribir_atomico
+
+
+#Directorio del espejo local en formato columnar
+DIRECTORIO = os.environ.get("ESPEJO_DIR", "data/espejo")
+#Columnas del detalle de tareas a conservar; vacío para conservar todas
+COLUMNAS_TAREAS = [c.strip() for c in os.environ.get("DETALLE_TAREAS_COLUMNAS", "").split(",") if c.strip()]
+
+#Conjunto del espejo: (recurso del datalake, formato, columna por la que se ordena cada fecha de mayor a menor)
+CONJUNTOS = {
+    "comercial": ("RESUMEN_CIERRE_URL", "json", None),
+    "normativo": ("RESUMEN_CIERE_NORMATIVO_URL", "json", None),
+    "tareas": ("DETALLE_TAREAS_URL", "parquet", "DURACION_SEGUNDOS"),
+}
+#Versiones reemplazadas que se recuerdan en el estado, para que un proceso con una copia vieja no la escriba encima
+HISTORIAL_VERSIONES = 20
+
+
+def _mapear(ruta: str) -> pa.Table:
+    """Abre una partición Arrow IPC con memory map: la tabla apunta al archivo, sin copiarlo."""
+    with pa.memory_map(ruta, "r") as fuente:
+        return pa.ipc.open_file(fuente).read_all()
+
+
+@contextmanager
+def _bloqueo_archivo(ruta: str):
+    """Bloqueo exclusivo entre procesos sobre `ruta`; el archivo se crea vacío si no existe."""
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta, "a+b") as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_EX)
+        else:
+            archivo.seek(0)
+            msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+            else:
+                archivo.seek(0)
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _conocida(estado: dict, version: str) -> bool:
+    """True si el estado ya está en `version` o si esa versión fue reemplazada por una posterior."""
+    return estado["version"] == version or version in estado.get("anteriores", ())
+
+
+def _serializar(tabla: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    return sink.getvalue().to_pybytes()
+
+
+def _suma(nombre: str) -> str:
+    """Suma de la partición, que va en el nombre del archivo: FECHA_CIERRE=<fecha>.<suma>.arrow."""
+    return nombre.rsplit(".", 2)[-2]
+
+
+class EspejoColumnar:
+    """Copia local de los datos del datalake en archivos Arrow IPC, uno por conjunto y fecha de cierre.
+
+    Cuando cambia la versión del blob se decodifica y se calcula una suma (crc32) de cada fecha:
+    solo se escriben las particiones cuya suma cambió y se retiran las fechas que ya no están en
+    el blob, así el espejo refleja las correcciones de fechas anteriores y un resumen de los
+    últimos N días no crece. La suma va en el nombre del archivo y `huellas` la expone para que
+    quien precalcula sobre el espejo sepa qué fechas cambiaron. Las particiones se abren con memory
+    map, así las consultas leen del page cache sin parsear ni copiar. El estado (versión del blob
+    y archivo de cada fecha) se guarda en disco: al reiniciar, si la versión no cambió no se
+    decodifica nada, y si el datalake no responde se sirve lo que hay en disco.
+
+    Varios procesos (los workers de la API) pueden compartir el directorio: la sincronización se
+    hace bajo un bloqueo de archivo, se relee `_estado.json` y, si otro proceso ya escribió esa
+    versión o una posterior, se adopta su estado en vez de escribir. Al reemplazar el estado solo
+    se borran los archivos que nombraba el estado anterior en disco.
+    """
+
+    def __init__(self, directorio: str = DIRECTORIO, cache_datalake: CacheDatalake = cache,
+                 conjuntos: dict = CONJUNTOS, columnas_tareas: list = None):
+        self.directorio = directorio
+        self.cache = cache_datalake
+        self.conjuntos = conjuntos
+        self.columnas_tareas = columnas_tareas if columnas_tareas is not None else COLUMNAS_TAREAS
+        self._estados: dict[str, dict] = {}
+        self._tablas: dict[str, dict[date, pa.Table]] = {}
+        self._sumas: dict[str, dict[date, str]] = {}
+        self._candados = {conjunto: threading.Lock() for conjunto in conjuntos}
+
+    def _ruta(self, conjunto: str, archivo: str = "") -> str:
+        return os.path.join(self.directorio, conjunto, archivo)
+
+    def _leer_estado(self, conjunto: str) -> dict:
+        """Estado guardado en disco del conjunto, o None si no hay uno legible."""
+        try:
+            with open(self._ruta(conjunto, "_estado.json"), "rb") as archivo:
+                guardado = orjson.loads(archivo.read())
+            return {"version": guardado["version"], "particiones": dict(guardado["particiones"]),
+                    "anteriores": list(guardado.get("anteriores", []))}
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Estado del espejo de {conjunto} ilegible: {e}")
+            return None
+
+    def _adoptar(self, conjunto: str, guardado: dict) -> bool:
+        """Toma el estado guardado en disco y mapea sus particiones, reutilizando las que ya
+        estaban mapeadas con el mismo archivo. Retorna False si el estado no se pudo abrir."""
+        actuales = self._estados.get(conjunto, {}).get("particiones", {})
+        mapeadas = self._tablas.get(conjunto, {})
+        try:
+            tablas = {}
+            for fecha, nombre in guardado["particiones"].items():
+                dia = date.fromisoformat(fecha)
+                if actuales.get(fecha) == nombre and dia in mapeadas:
+                    tablas[dia] = mapeadas[dia]
+                else:
+                    tablas[dia] = _mapear(self._ruta(conjunto, nombre))
+        except (OSError, TypeError, ValueError, pa.ArrowException) as e:
+            logging.warning(f"Espejo de {conjunto} incompleto, se reconstruye: {e}")
+            return False
+        self._tablas[conjunto] = tablas
+        self._sumas[conjunto] = {date.fromisoformat(fecha): _suma(nombre) for fecha, nombre in guardado["particiones"].items()}
+        self._estados[conjunto] = guardado
+        return True
+
+    def _cargar(self, conjunto: str):
+        """Carga del disco el estado y las particiones del conjunto si aún no están en memoria."""
+        if conjunto in self._estados:
+            return
+        self._estados[conjunto] = {"version": None, "particiones": {}}
+        self._tablas[conjunto] = {}
+        self._sumas[conjunto] = {}
+        guardado = self._leer_estado(conjunto)
+        if guardado is not None:
+            self._adoptar(conjunto, guardado)
+
+    def _decodificar(self, conjunto: str, contenido: bytes) -> dict:
+        """Particiones del blob por fecha de cierre."""
+        recurso, formato, orden = self.conjuntos[conjunto]
+        if formato == "parquet":
+            columnas = None
+            if conjunto == "tareas" and self.columnas_tareas:
+                columnas = list(dict.fromkeys(["FECHA_CIERRE", orden] + self.columnas_tareas))
+            tabla = pq.read_table(BytesIO(contenido), columns=columnas)
+        else:
+            tabla = pa.Table.from_pylist(orjson.loads(contenido))
+        if tabla.num_rows == 0:
+            return {}
+        fechas = pd.to_datetime(pd.Series(tabla.column("FECHA_CIERRE").to_pylist()).astype(str).str.slice(0, 10)).dt.date
+        particiones = {}
+        for fecha, indices in fechas.groupby(fechas).indices.items():
+            particion = tabla.take(indices)
+            if orden is not None:
+                particion = particion.sort_by([(orden, "descending")])
+            particiones[fecha] = particion
+        return particiones
+
+    def _escribir(self, conjunto: str, serializadas: dict, version: str, guardado: dict) -> dict:
+        """Escribe las particiones cuya suma cambió y el estado con todas las fechas del blob;
+        retorna las tablas mapeadas desde disco. El nombre incluye la suma, así nunca se reemplaza
+        un archivo que otro proceso tenga mapeado. Solo se borran los archivos del estado `guardado`
+        (el que había en disco) que dejan de usarse."""
+        estado = self._estados[conjunto]
+        mapeadas = self._tablas[conjunto]
+        particiones, tablas = {}, {}
+        for fecha, (suma, datos) in serializadas.items():
+            nombre = f"FECHA_CIERRE={fecha.isoformat()}.{suma}.arrow"
+            particiones[fecha.isoformat()] = nombre
+            if estado["particiones"].get(fecha.isoformat()) == nombre and fecha in mapeadas:
+                tablas[fecha] = mapeadas[fecha]
+                continue
+            if not os.path.exists(self._ruta(conjunto, nombre)):
+                escribir_atomico(self._ruta(conjunto, nombre), datos)
+            tablas[fecha] = _mapear(self._ruta(conjunto, nombre))
+        anteriores = [estado["version"]] + estado.get("anteriores", []) if estado["version"] is not None else []
+        anteriores = [v for v in dict.fromkeys(anteriores) if v != version][:HISTORIAL_VERSIONES]
+        nuevo = {"version": version, "particiones": particiones, "anteriores": anteriores}
+        escribir_atomico(self._ruta(conjunto, "_estado.json"), orjson.dumps(nuevo))
+        self._estados[conjunto] = nuevo
+        if guardado is not None:
+            for nombre in set(guardado["particiones"].values()) - set(particiones.values()):
+                try:
+                    os.remove(self._ruta(conjunto, nombre))
+                except OSError:
+                    pass
+        return tablas
+
+    def _serializar_particiones(self, conjunto: str, contenido: bytes) -> dict:
+        """Particiones del blob serializadas, con su suma: {fecha: (suma, bytes)}."""
+        serializadas = {}
+        for fecha, particion in self._decodificar(conjunto, contenido).items():
+            datos = _serializar(particion)
+            serializadas[fecha] = (f"{zlib.crc32(datos):08x}", datos)
+        return serializadas
+
+    def _sincronizar(self, conjunto: str):
+        recurso = self.conjuntos[conjunto][0]
+        contenido = self.cache.obtener(recurso)
+        version = self.cache.version(recurso)
+        estado = self._estados.get(conjunto)
+        if estado is not None and (contenido is None or _conocida(estado, version)):
+            return
+        with self._candados[conjunto]:
+            self._cargar(conjunto)
+            if contenido is None or _conocida(self._estados[conjunto], version):
+                return
+            serializadas = None
+            try:
+                with _bloqueo_archivo(self._ruta(conjunto, "_estado.lock")):
+                    # Otro proceso pudo sincronizar desde la última lectura: se parte de lo que hay en disco
+                    guardado = self._leer_estado(conjunto)
+                    if guardado is not None and guardado != self._estados[conjunto] \
+                            and not self._adoptar(conjunto, guardado):
+                        guardado = None
+                    if _conocida(self._estados[conjunto], version):
+                        return
+                    serializadas = self._serializar_particiones(conjunto, contenido)
+                    tablas = self._escribir(conjunto, serializadas, version, guardado)
+            except OSError as e:
+                # Sin disco el espejo sigue funcionando en memoria hasta el próximo intento
+                logging.warning(f"No se pudo escribir el espejo de {conjunto}: {e}")
+                if serializadas is None:
+                    serializadas = self._serializar_particiones(conjunto, contenido)
+                tablas = {fecha: pa.ipc.open_file(pa.py_buffer(datos)).read_all()
+                          for fecha, (suma, datos) in serializadas.items()}
+                self._estados[conjunto] = dict(self._estados[conjunto], version=version)
+            anteriores = self._sumas[conjunto]
+            sumas = {fecha: suma for fecha, (suma, datos) in serializadas.items()}
+            self._tablas[conjunto] = tablas
+            self._sumas[conjunto] = sumas
+            cambiadas = sum(1 for fecha, suma in sumas.items() if anteriores.get(fecha) != suma)
+            logging.info(f"Espejo de {conjunto}: {cambiadas} fechas actualizadas, "
+                         f"{len(anteriores.keys() - sumas.keys())} retiradas, {len(tablas)} en total")
+
+    def sincronizar(self, conjunto: str = None):
+        """Actualiza el espejo con la versión actual del datalake, de un conjunto o de todos."""
+        for nombre in ([conjunto] if conjunto else self.conjuntos):
+            self._sincronizar(nombre)
+
+    def reiniciar(self):
+        """Borra el espejo en memoria y en disco; la siguiente sincronización lo reconstruye completo."""
+        for conjunto, candado in self._candados.items():
+            with candado:
+                self._estados.pop(conjunto, None)
+                self._tablas.pop(conjunto, None)
+                self._sumas.pop(conjunto, None)
+                shutil.rmtree(self._ruta(conjunto), ignore_errors=True)
+
+    def version(self, conjunto: str) -> str:
+        """Versión del blob del datalake con la que está sincronizado el conjunto."""
+        self.sincronizar(conjunto)
+        estado = self._estados.get(conjunto)
+        return estado["version"] if estado else None
+
+    def fechas(self, conjunto: str) -> list:
+        self.sincronizar(conjunto)
+        return sorted(self._tablas.get(conjunto, {}))
+
+    def huellas(self, conjunto: str) -> dict:
+        """Suma del contenido de cada fecha del conjunto; cambia solo si cambian las filas de esa fecha."""
+        self.sincronizar(conjunto)
+        return dict(self._sumas.get(conjunto, {}))
+
+    def _particiones(self, conjunto: str, fecha_desde: date = None, fecha_hasta: date = None,
+                     ultimos: int = None) -> list:
+        self.sincronizar(conjunto)
+        tablas = self._tablas.get(conjunto, {})
+        fechas = [f for f in sorted(tablas)
+                  if (fecha_desde is None or f >= fecha_desde) and (fecha_hasta is None or f <= fecha_hasta)]
+        if ultimos:
+            fechas = fechas[-ultimos:]
+        return [tablas[f] for f in fechas]
+
+    def tabla(self, conjunto: str, fecha_desde: date = None, fecha_hasta: date = None,
+              ultimos: int = None, columnas: list = None) -> pa.Table:
+        """Filas del conjunto en el rango de fechas (o los últimos N cierres) como una sola tabla Arrow.
+        Retorna None si el conjunto no tiene datos."""
+        particiones = self._particiones(conjunto, fecha_desde, fecha_hasta, ultimos)
+        if not particiones:
+            return None
+        tabla = pa.concat_tables(particiones, promote_options="permissive")
+        if columnas:
+            tabla = tabla.select([c for c in columnas if c in tabla.column_names])
+        return tabla
+
+    def registros(self, conjunto: str, fecha_desde: date = None, fecha_hasta: date = None,
+                  ultimos: int = None, columnas: list = None) -> list:
+        """Igual que `tabla` pero como lista de dict en orden de fecha ascendente."""
+        registros = []
+        for particion in self._particiones(conjunto, fecha_desde, fecha_hasta, ultimos):
+            if columnas:
+                particion = particion.select([c for c in columnas if c in particion.column_names])
+            registros.extend(particion.to_pylist())
+        return registros
+
+    def mayor_duracion(self, fecha_cierre: date, n: int = 10, columnas: list = None) -> list:
+        """Las n tareas de mayor duración de la fecha; la partición ya está ordenada, es un slice."""
+        self.sincronizar("tareas")
+        particion = self._tablas.get("tareas", {}).get(fecha_cierre)
+        if particion is None:
+            return []
+        particion = particion.slice(0, n)
+        if columnas:
+            particion = particion.select([c for c in columnas if c in particion.column_names])
+        return particion.to_pylist()
+
+
+espejo = EspejoColumnar()
@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+import re
+import unicodedata
+
+
+PATRONES_FECHA = [
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), lambda m: (int(m[1]), int(m[2]), int(m[3]))),
+    (re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b"), lambda m: (int(m[3]), int(m[2]), int(m[1]))),
+]
+
+RELATIVAS = {"hoy": 0, "ayer": 1, "anteayer": 2, "antier": 2}
+DIAS_SEMANA = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+
+
+def sin_tildes(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+def resolver_fechas(texto: str, hoy: date = None) -> list:
+    """Retorna todas las fechas de cierre mencionadas en el texto, sin repetir, en orden de aparición.
+    Reconoce fechas YYYY-MM-DD, DD/MM/YYYY, las expresiones hoy, ayer y anteayer y los días
+    de la semana ("el lunes" es el último lunes anterior a hoy). Una fecha inválida se ignora."""
+    hoy = hoy or date.today()
+    encontradas = []
+    for patron, partes in PATRONES_FECHA:
+        for m in patron.finditer(texto):
+            try:
+                encontradas.append((m.start(), date(*partes(m))))
+            except ValueError:
+                pass
+    for m in re.finditer(r"\w+", sin_tildes(texto.lower())):
+        palabra = m[0]
+        if palabra in RELATIVAS:
+            encontradas.append((m.start(), hoy - timedelta(days=RELATIVAS[palabra])))
+        elif palabra in DIAS_SEMANA:
+            atras = (hoy.weekday() - DIAS_SEMANA[palabra] - 1) % 7 + 1
+            encontradas.append((m.start(), hoy - timedelta(days=atras)))
+    fechas = []
+    for _, fecha in sorted(encontradas, key=lambda e: e[0]):
+        if fecha not in fechas:
+            fechas.append(fecha)
+    return fechas
+
+
+def resolver_fecha(texto: str, hoy: date = None) -> date:
+    """Retorna la primera fecha de cierre mencionada en el texto o None si no menciona ninguna."""
+    fechas = resolver_fechas(texto, hoy)
+    return fechas[0] if fechas else None
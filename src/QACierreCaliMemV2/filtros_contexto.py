@@ -0,0 +1,87 @@
+from datetime import date
+import logging
+import os
+
+import orjson
+
+
+#Presupuesto de tokens para la salida de cada herramienta que se entrega al modelo
+MAX_TOKENS_HERRAMIENTA = int(os.environ.get("MAX_TOKENS_HERRAMIENTA", "2000"))
+#Caracteres por token para estimar el tamaño sin depender del tokenizador del modelo
+CARACTERES_POR_TOKEN = 4
+
+estadisticas = {"llamadas": 0, "tokens_originales": 0, "tokens_entregados": 0}
+
+
+def estimar_tokens(texto: str) -> int:
+    return len(texto) // CARACTERES_POR_TOKEN + 1
+
+
+def filtrar_registros(registros: list, fecha_desde: date = None, fecha_hasta: date = None,
+                      ultimos: int = None, campos: list = None) -> list:
+    """Filtra registros con FECHA_CIERRE por rango de fechas, últimos N cierres y campos.
+    Los registros se retornan ordenados por fecha de cierre ascendente."""
+    desde = fecha_desde.isoformat() if fecha_desde else None
+    hasta = fecha_hasta.isoformat() if fecha_hasta else None
+    seleccion = sorted(
+        (r for r in registros
+         if (desde is None or str(r.get("FECHA_CIERRE"))[:10] >= desde)
+         and (hasta is None or str(r.get("FECHA_CIERRE"))[:10] <= hasta)),
+        key=lambda r: str(r.get("FECHA_CIERRE")))
+    if ultimos:
+        seleccion = seleccion[-ultimos:]
+    if campos:
+        campos = ["FECHA_CIERRE"] + [c for c in campos if c != "FECHA_CIERRE"]
+        seleccion = [{c: r[c] for c in campos if c in r} for r in seleccion]
+    return seleccion
+
+
+def ajustar_presupuesto(registros: list, max_tokens: int = MAX_TOKENS_HERRAMIENTA) -> tuple:
+    """Conserva los registros más recientes que caben en el presupuesto de tokens.
+    Retorna (registros conservados, registros omitidos), ambos en orden ascendente."""
+    usados = 0
+    corte = len(registros)
+    while corte > 0:
+        tokens = estimar_tokens(orjson.dumps(registros[corte - 1], default=str).decode("utf-8"))
+        if usados + tokens > max_tokens:
+            break
+        usados += tokens
+        corte -= 1
+    return registros[corte:], registros[:corte]
+
+
+def resumir_omitidos(omitidos: list) -> dict:
+    """Resumen compacto de los registros que no cupieron: rango de fechas y promedios numéricos."""
+    resumen = {
+        "FECHAS_OMITIDAS": len(omitidos),
+        "DESDE": str(omitidos[0].get("FECHA_CIERRE"))[:10],
+        "HASTA": str(omitidos[-1].get("FECHA_CIERRE"))[:10],
+    }
+    numericos = [c for c, v in omitidos[0].items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    for campo in numericos:
+        valores = [r[campo] for r in omitidos if isinstance(r.get(campo), (int, float))]
+        if valores:
+            resumen[f"PROMEDIO_{campo}"] = round(sum(valores) / len(valores), 2)
+    return resumen
+
+
+def preparar_salida(registros: list, fecha_desde: date = None, fecha_hasta: date = None,
+                    ultimos: int = None, campos: list = None,
+                    max_tokens: int = MAX_TOKENS_HERRAMIENTA, originales: int = None) -> str:
+    """Aplica filtros y presupuesto de tokens y retorna el JSON que se entrega al modelo.
+    Si hubo que omitir fechas antiguas se agrega al final un registro de resumen.
+    Si `registros` ya viene filtrado, `originales` son los tokens del dato completo para las estadísticas."""
+    seleccion = filtrar_registros(registros, fecha_desde, fecha_hasta, ultimos, campos)
+    conservados, omitidos = ajustar_presupuesto(seleccion, max_tokens)
+    if omitidos:
+        conservados = conservados + [resumir_omitidos(omitidos)]
+    salida = orjson.dumps(conservados, default=str).decode("utf-8")
+
+    if originales is None:
+        originales = estimar_tokens(orjson.dumps(registros, default=str).decode("utf-8"))
+    entregados = estimar_tokens(salida)
+    estadisticas["llamadas"] += 1
+    estadisticas["tokens_originales"] += originales
+    estadisticas["tokens_entregados"] += entregados
+    logging.debug(f"Salida de herramienta: {originales} tokens originales, {entregados} entregados")
+    return salida
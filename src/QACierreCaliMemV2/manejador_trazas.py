@@ -0,0 +1,69 @@
+import sys
+import time
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.filtros_contexto import CARACTERES_POR_TOKEN, estimar_tokens
+from src.QACierreCaliMemV2.trazas import Turno
+
+
+def _uso_tokens(response: LLMResult) -> tuple:
+    """(tokens de prompt, tokens de respuesta) reportados por el proveedor, o (None, None)."""
+    for generaciones in response.generations:
+        for generacion in generaciones:
+            uso = getattr(getattr(generacion, "message", None), "usage_metadata", None)
+            if uso:
+                return uso.get("input_tokens"), uso.get("output_tokens")
+    uso = (response.llm_output or {}).get("token_usage") or {}
+    return uso.get("prompt_tokens"), uso.get("completion_tokens")
+
+
+class ManejadorTrazas(BaseCallbackHandler):
+    """Callback de LangChain que agrega al turno un span por cada llamada al modelo: latencia,
+    tiempo al primer token (en streaming) y tokens de prompt y respuesta. Si el proveedor no
+    informa los tokens se estiman por caracteres y el span queda marcado como estimado."""
+
+    def __init__(self, turno: Turno):
+        self.turno = turno
+        self._inicios = {}
+        self._primer_token = {}
+
+    def _iniciar(self, run_id: UUID, serialized: dict, texto: int):
+        nombre = (serialized or {}).get("name") or ((serialized or {}).get("id") or ["llm"])[-1]
+        self._inicios[run_id] = (time.perf_counter(), nombre, texto)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._iniciar(run_id, serialized, sum(len(str(m.content)) for lista in messages for m in lista))
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._iniciar(run_id, serialized, sum(len(p) for p in prompts))
+
+    def on_llm_new_token(self, token, *, run_id: UUID, **kwargs):
+        if run_id in self._inicios and run_id not in self._primer_token:
+            self._primer_token[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        inicio = self._inicios.pop(run_id, None)
+        if inicio is None:
+            return
+        reloj, nombre, caracteres_prompt = inicio
+        datos = {}
+        primer_token = self._primer_token.pop(run_id, None)
+        if primer_token is not None:
+            datos["primer_token"] = round(primer_token - reloj, 6)
+        prompt, respuesta = _uso_tokens(response)
+        if prompt is None:
+            texto = "".join(g.text for generaciones in response.generations for g in generaciones)
+            prompt, respuesta = caracteres_prompt // CARACTERES_POR_TOKEN + 1, estimar_tokens(texto)
+            datos["estimado"] = True
+        self.turno.agregar("llm", nombre, time.perf_counter() - reloj,
+                           tokens_prompt=prompt, tokens_respuesta=respuesta, **datos)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        inicio = self._inicios.pop(run_id, None)
+        self._primer_token.pop(run_id, None)
+        if inicio is not None:
+            self.turno.agregar("llm", inicio[1], time.perf_counter() - inicio[0], error=type(error).__name__)
@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.filtros_contexto import estimar_tokens
+
+
+#Configuración de la memoria de los hilos de conversación
+BACKEND = os.environ.get("CHECKPOINTER", "sqlite").lower()
+DIRECTORIO = os.environ.get("CHECKPOINTER_DIR", "data/sqlite")
+MAX_MENSAJES = int(os.environ.get("HILO_MAX_MENSAJES", "40"))
+MAX_HILOS = int(os.environ.get("MAX_HILOS", "500"))
+MAX_EDAD_HORAS = float(os.environ.get("HILO_MAX_EDAD_HORAS", "24"))
+INTERVALO_DESALOJO = float(os.environ.get("HILO_INTERVALO_DESALOJO", "60"))
+
+#Compactación del historial que se entrega al modelo en cada turno
+VENTANA_TURNOS = int(os.environ.get("HISTORIAL_VENTANA_TURNOS", "4"))
+TURNOS_CON_RESULTADOS = int(os.environ.get("HISTORIAL_TURNOS_CON_RESULTADOS", "1"))
+MAX_TOKENS_RESUMEN = int(os.environ.get("HISTORIAL_MAX_TOKENS_RESUMEN", "400"))
+MAX_CARACTERES_RESUMEN = 300
+PREFIJO_OMITIDO = "[Resultado omitido:"
+
+
+class SqliteSaverAsync(SqliteSaver):
+    """SqliteSaver con variantes async que delegan en las síncronas desde un hilo,
+    para poder usar el mismo checkpointer con invoke y con ainvoke."""
+
+    async def aget_tuple(self, *args, **kwargs):
+        return await asyncio.to_thread(self.get_tuple, *args, **kwargs)
+
+    async def alist(self, *args, **kwargs):
+        for item in await asyncio.to_thread(lambda: list(self.list(*args, **kwargs))):
+            yield item
+
+    async def aput(self, *args, **kwargs):
+        return await asyncio.to_thread(self.put, *args, **kwargs)
+
+    async def aput_writes(self, *args, **kwargs):
+        return await asyncio.to_thread(self.put_writes, *args, **kwargs)
+
+
+def crear_checkpointer(nombre: str, backend: str = BACKEND):
+    """Crea el checkpointer configurado: 'sqlite' (persistente, por defecto) o 'memoria'.
+        Args:
+            nombre: nombre de la base de datos de hilos, una por agente
+    """
+    if backend == "memoria":
+        return MemorySaver()
+    if backend != "sqlite":
+        logging.warning(f"Invalid CHECKPOINTER '{backend}', using sqlite instead.")
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DIRECTORIO, f"{nombre}.db"), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return SqliteSaverAsync(conn)
+
+
+def _tamano(valor) -> int:
+    if isinstance(valor, (bytes, bytearray, str)):
+        return len(valor)
+    if isinstance(valor, dict):
+        return sum(_tamano(k) + _tamano(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple)):
+        return sum(_tamano(v) for v in valor)
+    return 0
+
+
+def indice_recorte(mensajes: list, max_mensajes: int) -> int:
+    """Cantidad de mensajes antiguos a descartar para quedar en `max_mensajes`, cortando en una
+    pregunta del usuario para no separar llamadas a herramientas de sus resultados.
+    El último turno se conserva completo aunque por sí solo exceda `max_mensajes`."""
+    if len(mensajes) <= max_mensajes:
+        return 0
+    corte = len(mensajes) - max_mensajes
+    while corte < len(mensajes) and not isinstance(mensajes[corte], HumanMessage):
+        corte += 1
+    if corte == len(mensajes):
+        corte = max((i for i, m in enumerate(mensajes) if isinstance(m, HumanMessage)), default=0)
+    return corte
+
+
+def dividir_turnos(mensajes: list) -> list:
+    """Agrupa los mensajes en turnos; cada turno comienza en una pregunta del usuario."""
+    turnos = []
+    for m in mensajes:
+        if isinstance(m, HumanMessage) or not turnos:
+            turnos.append([])
+        turnos[-1].append(m)
+    return turnos
+
+
+def _texto(mensaje) -> str:
+    if isinstance(mensaje.content, str):
+        return mensaje.content
+    return " ".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in mensaje.content)
+
+
+def _abreviar(texto: str, max_caracteres: int = MAX_CARACTERES_RESUMEN) -> str:
+    texto = " ".join(texto.split())
+    return texto if len(texto) <= max_caracteres else texto[:max_caracteres] + "..."
+
+
+def abreviar_resultado(mensaje: ToolMessage) -> ToolMessage:
+    """Copia del resultado de una herramienta con el contenido reemplazado por un aviso.
+    Conserva id y tool_call_id, así sigue emparejado con su llamada y reemplaza al original en el hilo."""
+    contenido = _texto(mensaje)
+    if contenido.startswith(PREFIJO_OMITIDO):
+        return mensaje
+    return mensaje.model_copy(update={"content": f"{PREFIJO_OMITIDO} {len(contenido)} caracteres de {mensaje.name}; "
+                                                 f"consulte de nuevo la herramienta si necesita el detalle]"})
+
+
+def resumir_turnos(turnos: list, max_tokens: int = MAX_TOKENS_RESUMEN) -> str:
+    """Resumen de turnos anteriores con la pregunta y la respuesta final de cada uno, abreviadas.
+    Se toman del más reciente hacia atrás hasta agotar el presupuesto de tokens."""
+    lineas, usados = [], 0
+    for turno in reversed(turnos):
+        pregunta = _texto(turno[0]) if isinstance(turno[0], HumanMessage) else ""
+        respuesta = next((_texto(m) for m in reversed(turno)
+                          if isinstance(m, AIMessage) and not m.tool_calls and _texto(m)), "")
+        linea = f"- Pregunta: {_abreviar(pregunta)} Respuesta: {_abreviar(respuesta)}"
+        tokens = estimar_tokens(linea)
+        if usados + tokens > max_tokens:
+            break
+        lineas.append(linea)
+        usados += tokens
+    encabezado = "Resumen de la conversación anterior"
+    if len(lineas) < len(turnos):
+        encabezado += f" ({len(turnos) - len(lineas)} turnos más antiguos omitidos)"
+    return encabezado + ":\n" + "\n".join(reversed(lineas))
+
+
+def compactar_historial(mensajes: list, ventana_turnos: int = VENTANA_TURNOS,
+                        turnos_con_resultados: int = TURNOS_CON_RESULTADOS,
+                        max_tokens_resumen: int = MAX_TOKENS_RESUMEN) -> list:
+    """Historial acotado para enviar al modelo, sin modificar el guardado:
+        - los últimos `ventana_turnos` turnos completos; los anteriores se reemplazan por un resumen
+        - en esa ventana, los resultados de herramientas se conservan solo en el último turno y en
+          los `turnos_con_resultados` anteriores; en el resto quedan abreviados
+    """
+    turnos = dividir_turnos(mensajes)
+    ventana = max(1, ventana_turnos)
+    antiguos, recientes = turnos[:-ventana], turnos[-ventana:]
+    compactado = [SystemMessage(resumir_turnos(antiguos, max_tokens_resumen))] if antiguos else []
+    for i, turno in enumerate(recientes):
+        conservar = i >= len(recientes) - 1 - turnos_con_resultados
+        compactado.extend(m if conservar or not isinstance(m, ToolMessage) else abreviar_resultado(m) for m in turno)
+    return compactado
+
+
+def crear_modificador_estado(system_message: str):
+    """state_modifier para create_react_agent: el system prompt seguido del historial compactado."""
+    sistema = SystemMessage(system_message)
+
+    def modificar(estado) -> list:
+        return [sistema] + compactar_historial(estado["messages"])
+    return modificar
+
+
+class GestorHilos:
+    """Mantiene acotada la memoria de los hilos de un checkpointer.
+
+    - Recorta cada hilo a sus últimos `max_mensajes` mensajes, cortando siempre en una
+      pregunta del usuario para no separar llamadas a herramientas de sus resultados.
+    - Abrevia en el hilo guardado los resultados de herramientas de los turnos anteriores a los
+      últimos `turnos_con_resultados`, que son los que pueden llegar completos al modelo.
+    - Después de recortar conserva solo el último checkpoint del hilo: cada paso del agente y
+      cada update_state agregan uno nuevo con la lista completa de mensajes, y sin podarlos el
+      hilo crece en disco aunque el estado visible esté acotado.
+    - Desaloja los hilos inactivos por más de `max_edad_horas` y los más antiguos cuando
+      se supera `max_hilos`.
+    - Reporta hilos residentes y bytes ocupados con `metricas()`.
+    """
+
+    def __init__(self, checkpointer, max_mensajes: int = MAX_MENSAJES, max_hilos: int = MAX_HILOS,
+                 max_edad_horas: float = MAX_EDAD_HORAS, intervalo_desalojo: float = INTERVALO_DESALOJO,
+                 turnos_con_resultados: int = TURNOS_CON_RESULTADOS):
+        self.checkpointer = checkpointer
+        self.max_mensajes = max_mensajes
+        self.turnos_con_resultados = turnos_con_resultados
+        self.max_hilos = max_hilos
+        self.max_edad = max_edad_horas * 60 * 60
+        self.intervalo_desalojo = intervalo_desalojo
+        self._ultimo_desalojo = 0.0
+        self._uso: dict[str, float] = {}
+        self._candado = threading.Lock()
+        self.sqlite = isinstance(checkpointer, SqliteSaver)
+        if self.sqlite:
+            checkpointer.setup()
+            with checkpointer.cursor() as cur:
+                cur.execute("CREATE TABLE IF NOT EXISTS hilos_uso (thread_id TEXT PRIMARY KEY, ultimo_uso REAL)")
+
+    def registrar_uso(self, thread_id: str):
+        ahora = time.time()
+        if self.sqlite:
+            with self.checkpointer.cursor() as cur:
+                cur.execute("INSERT OR REPLACE INTO hilos_uso (thread_id, ultimo_uso) VALUES (?, ?)", (thread_id, ahora))
+        else:
+            with self._candado:
+                self._uso[thread_id] = ahora
+        if ahora - self._ultimo_desalojo > self.intervalo_desalojo:
+            self._ultimo_desalojo = ahora
+            self.desalojar()
+
+    def _actualizaciones(self, mensajes: list) -> list:
+        """Mensajes a remover por exceder la ventana y resultados de herramientas a abreviar."""
+        corte = indice_recorte(mensajes, self.max_mensajes)
+        actualizaciones = [RemoveMessage(id=m.id) for m in mensajes[:corte]]
+        turnos = dividir_turnos(mensajes[corte:])
+        for turno in turnos[:max(0, len(turnos) - self.turnos_con_resultados)]:
+            for m in turno:
+                abreviado = abreviar_resultado(m) if isinstance(m, ToolMessage) else m
+                if abreviado is not m:
+                    actualizaciones.append(abreviado)
+        return actualizaciones
+
+    def recortar(self, agente, config: dict):
+        """Elimina del hilo los mensajes más antiguos que exceden la ventana, abrevia los resultados
+        viejos y poda los checkpoints anteriores al último."""
+        estado = agente.get_state(config)
+        actualizaciones = self._actualizaciones(estado.values.get("messages", []))
+        if actualizaciones:
+            estado = agente.get_state(agente.update_state(config, {"messages": actualizaciones}))
+        self.podar(estado.config)
+
+    async def arecortar(self, agente, config: dict):
+        estado = await agente.aget_state(config)
+        actualizaciones = self._actualizaciones(estado.values.get("messages", []))
+        if actualizaciones:
+            estado = await agente.aget_state(await agente.aupdate_state(config, {"messages": actualizaciones}))
+        await asyncio.to_thread(self.podar, estado.config)
+
+    def podar(self, config: dict):
+        """Elimina los checkpoints y escrituras del hilo salvo los del checkpoint de `config`."""
+        configurable = (config or {}).get("configurable", {})
+        thread_id, checkpoint_id = configurable.get("thread_id"), configurable.get("checkpoint_id")
+        if thread_id is None or checkpoint_id is None:
+            return
+        if self.sqlite:
+            with self.checkpointer.cursor() as cur:
+                cur.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id != ?", (thread_id, checkpoint_id))
+                cur.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_id != ?", (thread_id, checkpoint_id))
+            return
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        with self._candado:
+            checkpoints = self.checkpointer.storage.get(thread_id, {}).get(checkpoint_ns, {})
+            ultimo = checkpoints.get(checkpoint_id)
+            if ultimo is None:
+                return
+            for clave in [c for c in checkpoints if c != checkpoint_id]:
+                del checkpoints[clave]
+            for clave in [k for k in self.checkpointer.writes if k[0] == thread_id and k[2] != checkpoint_id]:
+                del self.checkpointer.writes[clave]
+            # MemorySaver guarda los canales aparte por versión; se conservan los del último checkpoint
+            versiones = self.checkpointer.serde.loads_typed(ultimo[0]).get("channel_versions", {})
+            for clave in [k for k in self.checkpointer.blobs
+                          if k[0] == thread_id and k[1] == checkpoint_ns and versiones.get(k[2]) != k[3]]:
+                del self.checkpointer.blobs[clave]
+
+    def _usos(self) -> list:
+        """Hilos conocidos con su último uso, del más antiguo al más reciente."""
+        if self.sqlite:
+            with self.checkpointer.cursor(transaction=False) as cur:
+                cur.execute("SELECT thread_id, ultimo_uso FROM hilos_uso ORDER BY ultimo_uso")
+                return cur.fetchall()
+        with self._candado:
+            return sorted(self._uso.items(), key=lambda x: x[1])
+
+    def eliminar_hilo(self, thread_id: str):
+        if self.sqlite:
+            with self.checkpointer.cursor() as cur:
+                cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM hilos_uso WHERE thread_id = ?", (thread_id,))
+            return
+        with self._candado:
+            self._uso.pop(thread_id, None)
+            # MemorySaver indexa por thread_id o por tuplas que comienzan con el thread_id
+            for atributo in ("storage", "writes", "blobs"):
+                almacen = getattr(self.checkpointer, atributo, None)
+                if not isinstance(almacen, dict):
+                    continue
+                for clave in [k for k in almacen if k == thread_id or (isinstance(k, tuple) and k[0] == thread_id)]:
+                    del almacen[clave]
+
+    def desalojar(self) -> int:
+        """Elimina los hilos vencidos y los que exceden el máximo; retorna cuántos eliminó."""
+        usos = self._usos()
+        limite = time.time() - self.max_edad
+        excedente = max(0, len(usos) - self.max_hilos)
+        eliminar = [thread_id for i, (thread_id, ultimo_uso) in enumerate(usos)
+                    if i < excedente or ultimo_uso < limite]
+        for thread_id in eliminar:
+            self.eliminar_hilo(thread_id)
+        if eliminar:
+            logging.info(f"Hilos desalojados: {len(eliminar)}")
+        return len(eliminar)
+
+    def metricas(self) -> dict:
+        """Número de hilos residentes y bytes que ocupan en el checkpointer."""
+        if self.sqlite:
+            with self.checkpointer.cursor(transaction=False) as cur:
+                cur.execute("SELECT COUNT(DISTINCT thread_id), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints")
+                hilos, num_bytes = cur.fetchone()
+                cur.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes")
+                num_bytes += cur.fetchone()[0]
+                # Páginas en uso del archivo: lo que ocupa en disco sin contar el espacio liberado reutilizable
+                paginas = [cur.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in ("page_count", "freelist_count", "page_size")]
+            return {"hilos": hilos, "bytes": num_bytes, "bytes_archivo": (paginas[0] - paginas[1]) * paginas[2]}
+        with self._candado:
+            storage = getattr(self.checkpointer, "storage", {})
+            num_bytes = sum(_tamano(getattr(self.checkpointer, a, {})) for a in ("storage", "writes", "blobs"))
+            return {"hilos": len(storage), "bytes": num_bytes}
@@ -4,12 +4,22 @@ from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import AIMessage
 from dotenv import load_dotenv
 
+import os
 import sys
 
 load_dotenv()
 
 sys.path.append(".")
-from src.QACierreCaliMemV2.agentDATALAKE import get_response, df_cierre_comercial
+from src.QACierreCaliMemV2.agentDATALAKE import df_cierre_comercial
+if os.environ.get("AGENTE_API_URL"):
+    # Modo cliente liviano: el agente corre en la API con varios workers (run_api.sh)
+    from src.QACierreCaliMemV2.cliente_api import stream_response
+else:
+    from src.QACierreCaliMemV2.agentDATALAKE import stream_response
+from src.QACierreCaliMemV2.refrescador import iniciar_refrescador
+
+# Un solo refrescador por proceso mantiene los datos del datalake en memoria
+iniciar_refrescador()
 
 st.set_page_config(layout="wide")
 # Inicializar la memoria de chat
@@ -52,12 +62,19 @@ with col2:
                     st.markdown(prompt)
 
                 with st.status("Consultando información ..." , expanded=True) as status:
-                    
-                    response = get_response(prompt,st.session_state["thread_id"])
-                    st.session_state.chat_memory.add_ai_message(response)
+                    eventos = stream_response(prompt,st.session_state["thread_id"])
+
+                    # Los eventos de herramientas actualizan el estado y los tokens se muestran a medida que llegan
+                    def tokens():
+                        for tipo, contenido in eventos:
+                            if tipo == "herramienta":
+                                status.update(label=f"Consultando {contenido} ...")
+                            else:
+                                yield contenido
             # Mostrar la respuesta
                     with st.chat_message("assistant"):
-                        st.markdown(response) 
+                        response = st.write_stream(tokens())
+                        st.session_state.chat_memory.add_ai_message(response)
                         status.update(label="",state="complete")      
 
             
@@ -0,0 +1,35 @@
+import streamlit as st
+import pandas as pd
+
+import sys
+
+sys.path.append(".")
+from src.QACierreCaliMemV2 import trazas
+
+st.set_page_config(layout="wide")
+st.title("Trazas de las respuestas")
+
+# El archivo de trazas lo escriben todos los procesos (Streamlit y workers de la API)
+turnos = trazas.leer_archivo()
+if not turnos:
+    st.info(f"No hay trazas en {trazas.ARCHIVO}")
+    st.stop()
+
+totales = trazas.totales(turnos)
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Turnos", totales["turnos"])
+col2.metric("Errores", totales["errores"])
+col3.metric("Tokens prompt", totales["tokens_prompt"])
+col4.metric("Aciertos cache datalake", totales.get("cache_aciertos", 0))
+
+st.subheader("Duración por componente")
+componentes = pd.DataFrame(trazas.resumir(turnos))
+st.bar_chart(componentes, x="componente", y=["p50_ms", "p95_ms"], stack=False, y_label="ms")
+st.dataframe(componentes, hide_index=True)
+
+st.subheader("Últimos turnos")
+ultimos = pd.DataFrame([{"inicio": pd.to_datetime(t["inicio"], unit="s"), "agente": t["agente"], "ruta": t.get("ruta"),
+                         "duracion_s": t["duracion"], "llamadas_llm": sum(1 for s in t["spans"] if s["tipo"] == "llm"),
+                         "herramientas": ", ".join(s["nombre"] for s in t["spans"] if s["tipo"] == "herramienta"),
+                         "error": t.get("error")} for t in reversed(turnos[-50:])])
+st.dataframe(ultimos, hide_index=True)
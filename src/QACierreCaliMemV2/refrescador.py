@@ -0,0 +1,84 @@
+from datetime import datetime, time as hora
+import logging
+import os
+import sys
+import threading
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.cache_datalake import cache, CacheDatalake
+
+
+#Configuración del refresco en segundo plano
+RECURSOS = ["RESUMEN_CIERRE_URL", "RESUMEN_CIERE_NORMATIVO_URL", "DETALLE_TAREAS_URL"]
+INTERVALO_VENTANA = float(os.environ.get("REFRESCO_INTERVALO_VENTANA", "60"))
+INTERVALO_DIA = float(os.environ.get("REFRESCO_INTERVALO_DIA", "900"))
+VENTANA_INICIO = hora.fromisoformat(os.environ.get("REFRESCO_VENTANA_INICIO", "19:00"))
+VENTANA_FIN = hora.fromisoformat(os.environ.get("REFRESCO_VENTANA_FIN", "09:00"))
+
+
+def en_ventana_cierre(ahora: datetime, inicio: hora = VENTANA_INICIO, fin: hora = VENTANA_FIN) -> bool:
+    """Indica si la hora está dentro de la ventana del cierre nocturno (puede cruzar la medianoche)."""
+    actual = ahora.time()
+    if inicio <= fin:
+        return inicio <= actual < fin
+    return actual >= inicio or actual < fin
+
+
+class RefrescadorDatalake(threading.Thread):
+    """Hilo que mantiene actualizada la cache del datalake.
+
+    Revalida los recursos con más frecuencia durante la ventana del cierre y con menos durante
+    el día. Mientras está activo la cache sirve solo desde memoria, de modo que las herramientas
+    y df_cierre_comercial nunca esperan por la red. Después de cada ronda ejecuta los
+    `sincronizadores` (por ejemplo la actualización del espejo columnar) fuera del camino de la petición.
+    """
+
+    def __init__(self, cache_datalake: CacheDatalake = cache, recursos: list = RECURSOS,
+                 sincronizadores: list = None):
+        super().__init__(name="refrescador-datalake", daemon=True)
+        self.cache = cache_datalake
+        self.recursos = recursos
+        self.sincronizadores = sincronizadores or []
+        self._detener = threading.Event()
+        self.rondas = 0
+
+    def intervalo(self) -> float:
+        return INTERVALO_VENTANA if en_ventana_cierre(datetime.now()) else INTERVALO_DIA
+
+    def refrescar_una_vez(self):
+        for recurso in self.recursos:
+            if self.cache.refrescar(recurso):
+                logging.info(f"Nueva versión de {recurso} en memoria")
+        for sincronizar in self.sincronizadores:
+            sincronizar()
+        self.rondas += 1
+
+    def run(self):
+        self.cache.solo_memoria = True
+        while not self._detener.is_set():
+            try:
+                self.refrescar_una_vez()
+            except Exception as e:
+                logging.exception(f"Error refrescando datos del datalake: {e}")
+            self._detener.wait(self.intervalo())
+        self.cache.solo_memoria = False
+
+    def detener(self):
+        self._detener.set()
+
+
+_refrescador = None
+_candado = threading.Lock()
+
+
+def iniciar_refrescador() -> RefrescadorDatalake:
+    """Inicia el refrescador del proceso si no está corriendo y lo retorna."""
+    global _refrescador
+    with _candado:
+        if _refrescador is None or not _refrescador.is_alive():
+            from src.QACierreCaliMemV2.espejo_columnar import espejo
+            from src.QACierreCaliMemV2.snapshot_cierre import proveedor_snapshot
+            from src.QACierreCaliMemV2.analitica_cierre import analitica
+            _refrescador = RefrescadorDatalake(sincronizadores=[espejo.sincronizar, proveedor_snapshot.obtener, analitica.actualizar])
+            _refrescador.start()
+        return _refrescador
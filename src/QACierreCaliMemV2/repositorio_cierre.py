@@ -0,0 +1,125 @@
+from datetime import date
+import os
+import sys
+import threading
+
+import orjson
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.resumen_cierre import asegurar_resumen, actualizar_resumen
+
+
+#Origen de los datos de agent.py y chain.py: "espejo" (espejo columnar del datalake, el mismo de agentDATALAKE)
+#o "sqlite" (CIERRE_DB_URL) para leer directamente la base de cierre
+CIERRE_FUENTE = os.environ.get("CIERRE_FUENTE", "espejo")
+
+#Configuración de la base de datos de cierre
+CIERRE_DB_URL = os.environ.get("CIERRE_DB_URL", "sqlite:///data/sqlite/cierre.db")
+POOL_SIZE = int(os.environ.get("CIERRE_DB_POOL", "5"))
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": int(os.environ.get("CIERRE_DB_MMAP_BYTES", str(256 * 1024 * 1024))),
+    "cache_size": -int(os.environ.get("CIERRE_DB_CACHE_KB", str(64 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+SQL_RESUMEN = text("""select FECHA_CIERRE, DURACION_TOTAL_CIERRE as DURACION_TOTAL, DURACION_CIERRE_SIN_PAUSAS as DURACION_SIN_PAUSAS,
+            INICIO_CIERRE, FIN_CIERRE, FECHA_HABILITAR_MENU as HORA_HABILITAR_MENU
+            from cierre_resumen
+            order by FECHA_CIERRE""")
+
+SQL_TAREAS_MAYOR_DURACION = text("""select FECHA_CIERRE, TIME( DURACION, 'unixepoch') as DURACION, CODIGO_TAREA, DESCRIPCION_TAREA,
+            DATETIME(INICIO) as INICIO, DATETIME( FIN) as FIN
+            from Cierre
+            WHERE FECHA_CIERRE = :fecha_cierre
+            order by Cierre.DURACION desc LIMIT :limite""")
+
+#Columnas que entregan ambos repositorios, con los nombres de SQL_RESUMEN y SQL_TAREAS_MAYOR_DURACION
+COLUMNAS_RESUMEN = ["FECHA_CIERRE", "DURACION_TOTAL", "DURACION_SIN_PAUSAS", "INICIO_CIERRE", "FIN_CIERRE", "HORA_HABILITAR_MENU"]
+COLUMNAS_TAREAS = ["FECHA_CIERRE", "DURACION", "CODIGO_TAREA", "DESCRIPCION_TAREA", "INICIO", "FIN"]
+
+
+def crear_engine(url: str = CIERRE_DB_URL) -> Engine:
+    """Engine de SQLite con pool de conexiones; cada conexión nueva aplica los PRAGMAS."""
+    engine = create_engine(url, pool_size=POOL_SIZE, max_overflow=POOL_SIZE)
+
+    @event.listens_for(engine, "connect")
+    def aplicar_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, valor in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={valor}")
+        cursor.close()
+
+    return engine
+
+
+def a_json(filas: list) -> str:
+    """Serializa una lista de filas (dict) a JSON."""
+    return orjson.dumps(filas, default=str).decode("utf-8")
+
+
+class RepositorioCierre:
+    """Acceso a la base de cierre con parámetros enlazados y sentencias reutilizables."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._preparado = False
+        self._candado = threading.Lock()
+
+    def _preparar(self):
+        if self._preparado:
+            return
+        with self._candado:
+            if not self._preparado:
+                asegurar_resumen(self.engine)
+                self._preparado = True
+
+    def resumen(self) -> list:
+        """Resumen por fecha de cierre desde cierre_resumen."""
+        self._preparar()
+        actualizar_resumen(self.engine)
+        with self.engine.connect() as connection:
+            return [dict(row) for row in connection.execute(SQL_RESUMEN).mappings()]
+
+    def tareas_mayor_duracion(self, fecha_cierre: date, limite: int = 10) -> list:
+        """Tareas de mayor duración de la fecha, usando el índice (FECHA_CIERRE, DURACION)."""
+        self._preparar()
+        with self.engine.connect() as connection:
+            result = connection.execute(SQL_TAREAS_MAYOR_DURACION,
+                                        {"fecha_cierre": fecha_cierre.strftime("%Y-%m-%d"), "limite": limite})
+            return [dict(row) for row in result.mappings()]
+
+
+class RepositorioEspejo:
+    """Misma interfaz que RepositorioCierre sobre el espejo columnar del datalake, el mismo
+    almacén que usan las herramientas de agentDATALAKE."""
+
+    def __init__(self, espejo_columnar=None):
+        if espejo_columnar is None:
+            from src.QACierreCaliMemV2.espejo_columnar import espejo as espejo_columnar
+        self.espejo = espejo_columnar
+
+    def resumen(self) -> list:
+        return self.espejo.registros("comercial", columnas=COLUMNAS_RESUMEN)
+
+    def tareas_mayor_duracion(self, fecha_cierre: date, limite: int = 10) -> list:
+        return self.espejo.mayor_duracion(fecha_cierre, limite, columnas=COLUMNAS_TAREAS)
+
+
+_repositorio = None
+_candado_repositorio = threading.Lock()
+
+
+def obtener_repositorio():
+    """Repositorio compartido según CIERRE_FUENTE, creado en el primer uso."""
+    global _repositorio
+    with _candado_repositorio:
+        if _repositorio is None:
+            if CIERRE_FUENTE == "sqlite":
+                _repositorio = RepositorioCierre(crear_engine())
+            else:
+                _repositorio = RepositorioEspejo()
+        return _repositorio
@@ -0,0 +1,91 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+#Tabla materializada con el resumen por fecha de cierre y su mantenimiento incremental.
+#Los triggers sobre Cierre marcan como pendientes las fechas modificadas y
+#actualizar_resumen solo recalcula esas fechas.
+#Si Cierre se reemplaza (to_sql con if_exists="replace") se pierden el índice y los triggers;
+#al detectarlo se vuelven a crear y el resumen se reconstruye completo.
+OBJETOS = ("idx_cierre_fecha_duracion", "trg_cierre_resumen_insert", "trg_cierre_resumen_update", "trg_cierre_resumen_delete")
+SQL_ESTRUCTURA = [
+    "CREATE INDEX IF NOT EXISTS idx_cierre_fecha_duracion ON Cierre(FECHA_CIERRE, DURACION)",
+    """CREATE TABLE IF NOT EXISTS cierre_resumen (
+            FECHA_CIERRE TEXT PRIMARY KEY,
+            DURACION_TOTAL_CIERRE TEXT,
+            DURACION_CIERRE_SIN_PAUSAS TEXT,
+            INICIO_CIERRE TEXT,
+            FIN_CIERRE TEXT,
+            FECHA_HABILITAR_MENU TEXT)""",
+    "CREATE TABLE IF NOT EXISTS cierre_resumen_pendiente (FECHA_CIERRE TEXT PRIMARY KEY)",
+    """CREATE TRIGGER IF NOT EXISTS trg_cierre_resumen_insert AFTER INSERT ON Cierre
+            BEGIN INSERT OR IGNORE INTO cierre_resumen_pendiente VALUES (NEW.FECHA_CIERRE); END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_cierre_resumen_update AFTER UPDATE ON Cierre
+            BEGIN
+                INSERT OR IGNORE INTO cierre_resumen_pendiente VALUES (OLD.FECHA_CIERRE);
+                INSERT OR IGNORE INTO cierre_resumen_pendiente VALUES (NEW.FECHA_CIERRE);
+            END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_cierre_resumen_delete AFTER DELETE ON Cierre
+            BEGIN INSERT OR IGNORE INTO cierre_resumen_pendiente VALUES (OLD.FECHA_CIERRE); END""",
+]
+
+SQL_AGREGADO = """select FECHA_CIERRE, TIME(SUM( DURACION), 'unixepoch') as DURACION_TOTAL_CIERRE,  TIME(SUM(IIF(CODIGO_TAREA=='PAUSA',0,DURACION)),'unixepoch') AS DURACION_CIERRE_SIN_PAUSAS,
+            DATETIME( min(INICIO)) as INICIO_CIERRE, DATETIME( max(FIN)) as FIN_CIERRE, DATETIME(MAX(IIF(DESCRIPCION_TAREA='Habilita accesos al menu',FIN,0))) AS FECHA_HABILITAR_MENU
+            from Cierre
+            WHERE FECHA_CIERRE IS NOT NULL {filtro}
+            group by FECHA_CIERRE"""
+
+#Fechas de Cierre sin resumen y resúmenes de fechas que ya no están en Cierre (cambios que no pasaron por los triggers)
+SQL_FECHAS_DESCUADRADAS = """INSERT OR IGNORE INTO cierre_resumen_pendiente
+            select distinct FECHA_CIERRE from Cierre c
+            WHERE FECHA_CIERRE IS NOT NULL AND NOT EXISTS (select 1 from cierre_resumen r WHERE r.FECHA_CIERRE = c.FECHA_CIERRE)
+            UNION
+            select FECHA_CIERRE from cierre_resumen r
+            WHERE NOT EXISTS (select 1 from Cierre c WHERE c.FECHA_CIERRE = r.FECHA_CIERRE)"""
+
+
+def _asegurar(connection) -> bool:
+    """Crea lo que falte de la estructura. Retorna True si faltaba el índice o algún trigger: los
+    cambios hechos sin ellos no quedaron registrados, así que el resumen se descarta para reconstruirlo."""
+    existentes = {fila[0] for fila in connection.execute(
+        text("select name from sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'Cierre'"))}
+    if existentes.issuperset(OBJETOS):
+        return False
+    for sql in SQL_ESTRUCTURA:
+        connection.execute(text(sql))
+    connection.execute(text("delete from cierre_resumen"))
+    connection.execute(text("delete from cierre_resumen_pendiente"))
+    return True
+
+
+def asegurar_resumen(engine: Engine):
+    """Crea el índice, la tabla resumen y los triggers si no existen."""
+    with engine.begin() as connection:
+        if _asegurar(connection):
+            logging.info("Estructura del resumen de cierre creada; el resumen se reconstruye completo")
+
+
+def actualizar_resumen(engine: Engine) -> int:
+    """Recalcula el resumen de las fechas pendientes; la primera vez, o si faltan los triggers, lo
+    construye completo. También recalcula las fechas que no coinciden entre Cierre y el resumen.
+    Retorna el número de fechas recalculadas."""
+    with engine.begin() as connection:
+        _asegurar(connection)
+        vacio = connection.execute(text("select 1 from cierre_resumen limit 1")).first() is None
+        if vacio:
+            connection.execute(text("delete from cierre_resumen_pendiente"))
+            result = connection.execute(text("INSERT OR REPLACE INTO cierre_resumen " + SQL_AGREGADO.format(filtro="")))
+            return result.rowcount
+        connection.execute(text(SQL_FECHAS_DESCUADRADAS))
+        pendientes = connection.execute(text("select count(*) from cierre_resumen_pendiente")).scalar()
+        if not pendientes:
+            return 0
+        filtro = "AND FECHA_CIERRE IN (select FECHA_CIERRE from cierre_resumen_pendiente)"
+        connection.execute(text("delete from cierre_resumen WHERE FECHA_CIERRE IN (select FECHA_CIERRE from cierre_resumen_pendiente)"))
+        connection.execute(text("INSERT INTO cierre_resumen " + SQL_AGREGADO.format(filtro=filtro)))
+        connection.execute(text("delete from cierre_resumen_pendiente"))
+    logging.info(f"Resumen de cierre actualizado para {pendientes} fechas")
+    return pendientes
+
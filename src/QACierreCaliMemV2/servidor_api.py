@@ -0,0 +1,65 @@
+from contextlib import asynccontextmanager
+import sys
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import orjson
+from pydantic import BaseModel
+
+sys.path.append(".")
+from src.QACierreCaliMemV2 import agentDATALAKE
+from src.QACierreCaliMemV2.refrescador import iniciar_refrescador
+from src.QACierreCaliMemV2 import trazas
+
+
+#API local del agente del datalake. Se ejecuta con varios workers de uvicorn (ver run_api.sh);
+#el estado de los hilos vive en el checkpointer SQLite compartido, no en el proceso.
+
+
+class Pregunta(BaseModel):
+    pregunta: str
+    thread_id: str
+
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    iniciar_refrescador()
+    yield
+
+
+app = FastAPI(title="Consultas Cierre", lifespan=ciclo_de_vida)
+
+
+@app.post("/respuesta")
+async def respuesta(pregunta: Pregunta) -> dict:
+    texto = await agentDATALAKE.aget_response(pregunta.pregunta, pregunta.thread_id)
+    return {"respuesta": texto}
+
+
+@app.post("/stream")
+def stream(pregunta: Pregunta) -> StreamingResponse:
+    """Eventos de stream_response como JSON por línea: {"tipo": ..., "contenido": ...}."""
+    def lineas():
+        for tipo, contenido in agentDATALAKE.stream_response(pregunta.pregunta, pregunta.thread_id):
+            yield orjson.dumps({"tipo": tipo, "contenido": contenido}) + b"\n"
+    return StreamingResponse(lineas(), media_type="application/x-ndjson")
+
+
+@app.get("/salud")
+def salud() -> dict:
+    return {"estado": "ok"}
+
+
+@app.get("/metricas")
+def metricas() -> PlainTextResponse:
+    """Duración p50/p95 por componente, contadores de los últimos turnos y memoria de los hilos, en formato OpenMetrics."""
+    hilos = agentDATALAKE.obtener_gestor_hilos().metricas()
+    return PlainTextResponse(trazas.openmetrics(trazas.registro.turnos(), hilos),
+                             media_type="application/openmetrics-text; version=1.0.0; charset=utf-8")
+
+
+@app.get("/metricas/resumen")
+def resumen_metricas() -> dict:
+    turnos = trazas.registro.turnos()
+    return {"componentes": trazas.resumir(turnos), "totales": trazas.totales(turnos),
+            "hilos": agentDATALAKE.obtener_gestor_hilos().metricas()}
@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+import logging
+import sys
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.append(".")
+from src.QACierreCaliMemV2.espejo_columnar import espejo, EspejoColumnar
+
+
+@dataclass(frozen=True)
+class SnapshotCierre:
+    """Resumen comercial ya procesado, compartido por todas las sesiones del proceso.
+
+    El DataFrame es de solo lectura por convención: las páginas lo grafican sin copiarlo.
+    Cada versión del blob produce un snapshot nuevo; el anterior no se modifica.
+    """
+    version: str
+    df: pd.DataFrame
+    creado: float
+
+    def memoria_bytes(self) -> int:
+        return int(self.df.memory_usage(deep=True).sum())
+
+
+def construir_dataframe(tabla: pa.Table) -> pd.DataFrame:
+    """Convierte el resumen comercial del espejo y precalcula las columnas de horas con tipos compactos."""
+    df:pd.DataFrame=tabla.to_pandas()
+    #Formatear fecha y duraciones
+    df["FECHA_CIERRE"]=df.FECHA_CIERRE.str.slice(0,10).astype("category")
+    df["Duración Total"]= (df.DURACION_TOTAL_CIERRE_SEGUNDOS/60/60).astype("float32")
+    df["Sin Pausas"]= (df.DURACION_SIN_PAUSAS_SEGUNDOS/60/60).astype("float32")
+    df["Total Pausas"]=  df["Duración Total"]-df["Sin Pausas"]
+    for columna in df.columns:
+        if df[columna].dtype == object:
+            df[columna] = df[columna].astype("string[pyarrow]")
+    return df
+
+
+class ProveedorSnapshot:
+    """Entrega el snapshot vigente y lo reconstruye solo cuando cambia la versión del conjunto en el espejo."""
+
+    def __init__(self, conjunto: str = "comercial", espejo_columnar: EspejoColumnar = espejo):
+        self.conjunto = conjunto
+        self.espejo = espejo_columnar
+        self._snapshot = None
+        self._candado = threading.Lock()
+
+    def obtener(self) -> SnapshotCierre:
+        version = self.espejo.version(self.conjunto)
+        if version is None:
+            return self._snapshot
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._candado:
+            if self._snapshot is None or self._snapshot.version != version:
+                tabla = self.espejo.tabla(self.conjunto)
+                if tabla is None:
+                    return self._snapshot
+                self._snapshot = SnapshotCierre(version, construir_dataframe(tabla), time.time())
+                logging.info(f"Snapshot de cierre {version}: {len(self._snapshot.df)} fechas, {self._snapshot.memoria_bytes()} bytes")
+            return self._snapshot
+
+
+proveedor_snapshot = ProveedorSnapshot()
@@ -0,0 +1,261 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+
+import orjson
+
+
+#Trazas por turno: tiempos del modelo y de las herramientas, tokens, bytes del datalake y uso de caches
+ARCHIVO = os.environ.get("TRAZAS_ARCHIVO", "data/trazas/trazas.jsonl")
+MAX_BYTES_ARCHIVO = int(os.environ.get("TRAZAS_MAX_BYTES", str(10 * 1024 * 1024)))
+MAX_TURNOS = int(os.environ.get("TRAZAS_MAX_TURNOS", "1000"))
+
+_turno_actual: ContextVar = ContextVar("turno_actual", default=None)
+
+
+class Turno:
+    """Traza de un turno de conversación: duración total, un span por cada llamada al modelo,
+    herramienta o petición al datalake, y contadores (aciertos de cache, bytes descargados)."""
+
+    def __init__(self, agente: str, hilo: str):
+        self.id = uuid.uuid4().hex
+        self.agente = agente
+        self.hilo = hilo
+        self.inicio = time.time()
+        self.duracion = None
+        self.error = None
+        self.atributos = {"ruta": "agente"}
+        self.spans = []
+        self.contadores = {}
+        self._reloj = time.perf_counter()
+        self._candado = threading.Lock()
+
+    def agregar(self, tipo: str, nombre: str, duracion: float, **datos):
+        with self._candado:
+            self.spans.append({"tipo": tipo, "nombre": nombre, "duracion": round(duracion, 6), **datos})
+
+    def contar(self, clave: str, cantidad: int = 1):
+        with self._candado:
+            self.contadores[clave] = self.contadores.get(clave, 0) + cantidad
+
+    def finalizar(self, error: BaseException = None):
+        self.duracion = round(time.perf_counter() - self._reloj, 6)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def a_dict(self) -> dict:
+        with self._candado:
+            return {"id": self.id, "agente": self.agente, "hilo": self.hilo, "inicio": self.inicio,
+                    "duracion": self.duracion, "error": self.error, **self.atributos,
+                    "spans": list(self.spans), "contadores": dict(self.contadores)}
+
+
+def actual() -> Turno:
+    """Turno activo en el contexto actual o None (por ejemplo en el refrescador)."""
+    return _turno_actual.get()
+
+
+def contar(clave: str, cantidad: int = 1):
+    turno = _turno_actual.get()
+    if turno is not None:
+        turno.contar(clave, cantidad)
+
+
+def registrar_span(tipo: str, nombre: str, duracion: float, **datos):
+    turno = _turno_actual.get()
+    if turno is not None:
+        turno.agregar(tipo, nombre, duracion, **datos)
+
+
+def anotar(**atributos):
+    """Agrega atributos al turno activo, por ejemplo la ruta que respondió la pregunta."""
+    turno = _turno_actual.get()
+    if turno is not None:
+        turno.atributos.update(atributos)
+
+
+def medir_herramienta(funcion):
+    """Decorador para las herramientas del agente: registra su duración y los bytes de la salida."""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        inicio = time.perf_counter()
+        salida = None
+        try:
+            salida = funcion(*args, **kwargs)
+            return salida
+        finally:
+            registrar_span("herramienta", funcion.__name__, time.perf_counter() - inicio,
+                           bytes=len(salida.encode("utf-8")) if isinstance(salida, str) else 0)
+    return envoltura
+
+
+@contextmanager
+def activar(turno: Turno):
+    """Hace de `turno` el turno activo solo dentro del bloque."""
+    token = _turno_actual.set(turno)
+    try:
+        yield turno
+    finally:
+        _turno_actual.reset(token)
+
+
+def iterar(turno: Turno, iterable):
+    """Recorre `iterable` con el turno activo mientras se produce cada elemento.
+    Para generadores que se consumen desde otros contextos (Streamlit, StreamingResponse),
+    donde el turno no puede quedar activo entre un elemento y el siguiente."""
+    iterador = iter(iterable)
+    while True:
+        with activar(turno):
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                return
+        yield elemento
+
+
+@contextmanager
+def turno(agente: str, hilo: str, activo: bool = True):
+    """Abre la traza de un turno y la guarda en el registro al terminar, incluso si falla.
+    Con `activo` el turno queda activo en el bloque; en generadores se usa `activo=False` con `iterar`."""
+    nuevo = Turno(agente, hilo)
+    token = _turno_actual.set(nuevo) if activo else None
+    try:
+        yield nuevo
+    except BaseException as e:
+        # GeneratorExit: quien consumía el stream dejó de leerlo, no es un error del turno
+        nuevo.finalizar(None if isinstance(e, GeneratorExit) else e)
+        raise
+    else:
+        nuevo.finalizar()
+    finally:
+        if token is not None:
+            _turno_actual.reset(token)
+        registro.guardar(nuevo)
+
+
+def percentil(valores: list, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def componentes(turnos: list) -> dict:
+    """Duraciones en segundos agrupadas por componente: el turno según la ruta que respondió,
+    el modelo, cada herramienta y las peticiones al datalake."""
+    duraciones = {}
+    for t in turnos:
+        if t.get("duracion") is not None:
+            duraciones.setdefault(f"turno:{t.get('ruta', 'agente')}", []).append(t["duracion"])
+        for span in t.get("spans", []):
+            clave = "llm" if span["tipo"] == "llm" else f"{span['tipo']}:{span['nombre']}"
+            duraciones.setdefault(clave, []).append(span["duracion"])
+    return duraciones
+
+
+def resumir(turnos: list) -> list:
+    """Filas con n, p50 y p95 en milisegundos por componente, de mayor a menor p95."""
+    filas = [{"componente": clave, "n": len(valores),
+              "p50_ms": round(percentil(valores, 0.5) * 1000, 1),
+              "p95_ms": round(percentil(valores, 0.95) * 1000, 1),
+              "total_s": round(sum(valores), 3)}
+             for clave, valores in componentes(turnos).items()]
+    return sorted(filas, key=lambda f: f["p95_ms"], reverse=True)
+
+
+def totales(turnos: list) -> dict:
+    """Suma de contadores y tokens de los turnos."""
+    suma = {"turnos": len(turnos), "errores": 0, "tokens_prompt": 0, "tokens_respuesta": 0}
+    for t in turnos:
+        suma["errores"] += 1 if t.get("error") else 0
+        for clave, valor in t.get("contadores", {}).items():
+            suma[clave] = suma.get(clave, 0) + valor
+        for span in t.get("spans", []):
+            if span["tipo"] == "llm":
+                suma["tokens_prompt"] += span.get("tokens_prompt") or 0
+                suma["tokens_respuesta"] += span.get("tokens_respuesta") or 0
+    return suma
+
+
+def openmetrics(turnos: list, hilos: dict = None) -> str:
+    """Exposición en formato OpenMetrics: un summary de duración por componente y contadores.
+    Con `hilos` (GestorHilos.metricas()) agrega los hilos residentes y los bytes que ocupan."""
+    lineas = ["# TYPE cierre_componente_segundos summary", "# UNIT cierre_componente_segundos seconds"]
+    for clave, valores in sorted(componentes(turnos).items()):
+        etiqueta = f'componente="{clave}"'
+        for q in (0.5, 0.95):
+            lineas.append(f'cierre_componente_segundos{{{etiqueta},quantile="{q}"}} {percentil(valores, q):.6f}')
+        lineas.append(f"cierre_componente_segundos_count{{{etiqueta}}} {len(valores)}")
+        lineas.append(f"cierre_componente_segundos_sum{{{etiqueta}}} {sum(valores):.6f}")
+    lineas.append("# TYPE cierre_eventos counter")
+    for clave, valor in sorted(totales(turnos).items()):
+        lineas.append(f'cierre_eventos_total{{evento="{clave}"}} {valor}')
+    if hilos is not None:
+        lineas += ["# TYPE cierre_hilos gauge", f"cierre_hilos {hilos['hilos']}",
+                   "# TYPE cierre_hilos_bytes gauge", "# UNIT cierre_hilos_bytes bytes",
+                   f'cierre_hilos_bytes{{medida="contenido"}} {hilos["bytes"]}']
+        if "bytes_archivo" in hilos:
+            lineas.append(f'cierre_hilos_bytes{{medida="archivo"}} {hilos["bytes_archivo"]}')
+    lineas.append("# EOF")
+    return "\n".join(lineas) + "\n"
+
+
+def leer_archivo(ruta: str = ARCHIVO, ultimos: int = MAX_TURNOS) -> list:
+    """Últimos turnos guardados en el archivo JSONL (de todos los procesos que escriben en él)."""
+    try:
+        with open(ruta, "rb") as archivo:
+            lineas = deque(archivo, maxlen=ultimos)
+    except OSError:
+        return []
+    turnos = []
+    for linea in lineas:
+        try:
+            turnos.append(orjson.loads(linea))
+        except orjson.JSONDecodeError:
+            continue
+    return turnos
+
+
+class RegistroTrazas:
+    """Conserva los últimos turnos en memoria y los agrega a un archivo JSONL.
+    Cuando el archivo supera `max_bytes` se renombra a .1 y se empieza uno nuevo."""
+
+    def __init__(self, archivo: str = ARCHIVO, max_turnos: int = MAX_TURNOS, max_bytes: int = MAX_BYTES_ARCHIVO):
+        self.archivo = archivo
+        self.max_bytes = max_bytes
+        self._turnos = deque(maxlen=max_turnos)
+        self._candado = threading.Lock()
+
+    def guardar(self, turno: Turno):
+        datos = turno.a_dict()
+        llm = [s for s in datos["spans"] if s["tipo"] == "llm"]
+        logging.info(f"Turno {datos['agente']} ruta={datos['ruta']} duracion={datos['duracion']:.3f}s "
+                     f"llm={len(llm)} ({sum(s['duracion'] for s in llm):.3f}s) "
+                     f"herramientas={sum(1 for s in datos['spans'] if s['tipo'] == 'herramienta')}")
+        linea = orjson.dumps(datos, default=str) + b"\n"
+        with self._candado:
+            self._turnos.append(datos)
+            if not self.archivo:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.archivo) or ".", exist_ok=True)
+                if os.path.exists(self.archivo) and os.path.getsize(self.archivo) > self.max_bytes:
+                    os.replace(self.archivo, self.archivo + ".1")
+                with open(self.archivo, "ab") as archivo:
+                    archivo.write(linea)
+            except OSError as e:
+                logging.warning(f"No se pudo escribir la traza en {self.archivo}: {e}")
+
+    def turnos(self) -> list:
+        """Últimos turnos: del archivo si está configurado (incluye otros workers), si no de memoria."""
+        if self.archivo:
+            return leer_archivo(self.archivo, self._turnos.maxlen)
+        with self._candado:
+            return list(self._turnos)
+
+
+registro = RegistroTrazas()